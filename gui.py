@@ -2,6 +2,8 @@ import rb2tk
 
 from platformdirs import user_config_dir
 import threading
+import queue
+import multiprocessing
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext, font
@@ -33,17 +35,63 @@ APP_VERSION = rb2tk.RB2TK_VERSION
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 
-class TextHandler(logging.Handler):
-    def __init__(self, text_widget):
+LOG_POLL_MS     = 100    # Interval at which the Tk main loop drains the event queue
+LOG_BATCH_SIZE  = 2000   # Max. events handled per poll, keeps the UI responsive
+LOG_MAX_LINES   = 5000   # Older lines are dropped from the log widget
+
+
+class QueueHandler(logging.Handler):
+    """
+    Thread-safe log handler: records are formatted on the emitting thread and
+    queued; the Tk main loop drains the queue (see App._poll_events).
+    """
+    def __init__(self, event_queue):
         super().__init__()
-        self.text_widget = text_widget
+        self.event_queue = event_queue
 
     def emit(self, record):
-        msg = self.format(record)
-        self.text_widget.configure(state='normal')
-        self.text_widget.insert(tk.END, msg + '\n')
-        self.text_widget.see(tk.END)
-        self.text_widget.configure(state='disabled')
+        try:
+            self.event_queue.put_nowait(("log", self.format(record)))
+        except Exception:
+            self.handleError(record)
+
+
+class JobController:
+    """
+    Runs at most one conversion at a time on a background thread, and lets
+    the UI cancel it cooperatively through an rb2tk.CancelToken.
+    """
+    def __init__(self):
+        self.thread = None
+        self.token = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, target) -> bool:
+        """
+        Starts target(token) on a daemon thread; refuses if a job is still running.
+        """
+        if self.running:
+            return False
+        self.token = rb2tk.CancelToken()
+        self.thread = threading.Thread(target=target, args=(self.token,), daemon=True)
+        self.thread.start()
+        return True
+
+    def finish(self):
+        """
+        Waits for the job's thread to exit, once it reported being done (its very last step),
+        so that a new job can be started right away.
+        """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def cancel(self):
+        if self.running:
+            self.token.cancel()
 
 
 class ToolTip:
@@ -90,8 +138,20 @@ class App(tk.Tk):
         button_frame = ttk.Frame(self)
         button_frame.pack(fill=tk.X, padx=10, pady=5, anchor='se')
 
-        run_button = ttk.Button(button_frame, text="Run", command=self.on_run)
-        run_button.pack(side=tk.RIGHT)
+        self.run_button = ttk.Button(button_frame, text="Run", command=self.on_run)
+        self.run_button.pack(side=tk.RIGHT)
+
+        self.cancel_button = ttk.Button(button_frame, text="Cancel", command=self.on_cancel, state="disabled")
+        self.cancel_button.pack(side=tk.RIGHT, padx=(0, 5))
+        ToolTip(self.cancel_button, "Stops the running conversion. The existing collection is left untouched.")
+        self.job = JobController()
+
+        # Progress bar + current stage
+        self.progress_var = tk.DoubleVar(value=0.0)
+        self.progress_bar = ttk.Progressbar(button_frame, variable=self.progress_var, maximum=100.0)
+        self.progress_bar.pack(side=tk.RIGHT, fill=tk.X, expand=True, padx=(10, 10))
+        self.stage_var = tk.StringVar(value="")
+        ttk.Label(button_frame, textvariable=self.stage_var, width=24).pack(side=tk.LEFT)
 
         # Log formatting
         log_formatter = logging.Formatter('%(levelname)s @ %(funcName)s: %(message)s')
@@ -99,13 +159,15 @@ class App(tk.Tk):
         stdout_handler = logging.StreamHandler(sys.stdout)
         stdout_handler.setFormatter(log_formatter)
 
-        text_handler = TextHandler(self.log_output)
-        text_handler.setFormatter(log_formatter)
+        self.events = queue.Queue()
+        queue_handler = QueueHandler(self.events)
+        queue_handler.setFormatter(log_formatter)
 
         logger = logging.getLogger()
         logger.setLevel(logging.INFO)
         logger.addHandler(stdout_handler)
-        logger.addHandler(text_handler)
+        logger.addHandler(queue_handler)
+        self.after(LOG_POLL_MS, self._poll_events)
         
         logger.info("Hover your mouse over any element for more information.")
 
@@ -189,6 +251,60 @@ class App(tk.Tk):
         save_button = ttk.Button(button_frame, text="Save Log", command=self._save_log)
         save_button.pack(side="left")
 
+    def _poll_events(self):
+        """
+        Drains queued log/progress events on the Tk main loop. Log lines are inserted
+        in a single batch, with runs of identical messages coalesced into one line.
+        """
+        lines = []
+        progress = None
+        last, repeats = None, 0
+
+        for _ in range(LOG_BATCH_SIZE):
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == "progress":
+                progress = event[1:]
+            elif event[0] == "done":
+                self.job.finish()
+                self._set_running(False)
+            elif event[1] == last:
+                repeats += 1
+            else:
+                if repeats > 0:
+                    lines[-1] += f" (x{repeats + 1})"
+                lines.append(event[1])
+                last, repeats = event[1], 0
+        if repeats > 0:
+            lines[-1] += f" (x{repeats + 1})"
+
+        if len(lines) > 0:
+            self._append_log(lines)
+        if progress is not None:
+            stage, done, total = progress
+            self.stage_var.set(stage)
+            self.progress_var.set(100.0 * done / total if total > 0 else 0.0)
+
+        # Come back right away if the queue is still backed up.
+        self.after(1 if not self.events.empty() else LOG_POLL_MS, self._poll_events)
+
+    def _append_log(self, lines):
+        self.log_output.configure(state='normal')
+        self.log_output.insert(tk.END, "\n".join(lines) + "\n")
+        excess = int(self.log_output.index("end-1c").split(".")[0]) - 1 - LOG_MAX_LINES
+        if excess > 0:
+            self.log_output.delete("1.0", f"{excess + 1}.0")
+        self.log_output.see(tk.END)
+        self.log_output.configure(state='disabled')
+
+    def _on_progress(self, stage, done, total):
+        """
+        Progress callback handed to the rb2tk stages; called from the worker thread.
+        """
+        self.events.put_nowait(("progress", stage, done, total))
+
     def _clear_log(self):
         self.log_output.config(state="normal")
         self.log_output.delete("1.0", "end")
@@ -319,6 +435,7 @@ class App(tk.Tk):
             self.loop_quant_var.set(self.loop_quant_options[min(i, len(self.loop_quant_options) - 1)])
 
     def _on_close(self):
+        self.job.cancel()
         self._save_config()
         self.destroy()
 
@@ -330,30 +447,49 @@ class App(tk.Tk):
         if file_path:
             var.set(file_path)
 
-    def run_rb2tk(self):
+    def run_rb2tk(self, config, token):
         result = False
         try:
             logging.info("Starting " + APP_NAME + " v" + APP_VERSION)
-            config = self._generate_config()
 
-            rr = rb2tk.RekordboxReader(config)
-            tw = rb2tk.TraktorWriter(config)
-            oo = rb2tk.OptionalOperations(config)
+            rr = rb2tk.RekordboxReader(config, self._on_progress, token)
+            tw = rb2tk.TraktorWriter(config, self._on_progress, token)
+            oo = rb2tk.OptionalOperations(config, self._on_progress, token)
 
             lib = rr.read(config["Library"]["RekordboxXmlInput"])
             lib = oo.apply(lib)
             result = tw.write(lib, config["Library"]["TraktorNmlOutput"])
+        except rb2tk.Cancelled:
+            logging.warning("Cancelled - the existing collection was left untouched.")
         except Exception as e:
             logging.error(str(e))
         else:
             if result:
                 logging.info("Done!")
+        finally:
+            self.events.put_nowait(("done",))
+
+    def _set_running(self, running):
+        self.run_button.configure(state="disabled" if running else "normal")
+        self.cancel_button.configure(state="normal" if running else "disabled")
+        if not running:
+            self.stage_var.set("")
+            self.progress_var.set(0.0)
 
     def on_run(self):
-        thread = threading.Thread(target=self.run_rb2tk, daemon=True)
-        thread.start()
+        # The config is generated here, as Tk variables must only be read from the main thread.
+        config = self._generate_config()
+        if self.job.start(lambda token: self.run_rb2tk(config, token)):
+            self._set_running(True)
+        else:
+            messagebox.showinfo(APP_NAME, "A conversion is still running. Wait for it to finish, or cancel it.")
+
+    def on_cancel(self):
+        logging.info("Cancelling...")
+        self.job.cancel()
         
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # rb2tk may parse large libraries in a process pool
     app = App()
     app.mainloop()
@@ -2,35 +2,60 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
 import sys
+import json
+import mmap
 import uuid
 import math
+import time
+import struct
 import argparse
 import shutil
+import fnmatch
 import logging
+import threading
 import configparser
 import subprocess
+import hashlib
+import contextlib
+import html
+import unicodedata
+import collections
+import concurrent.futures
 
 import xml.etree.ElementTree as ET
-from xml.dom import minidom
 from datetime import datetime
 
 from enum import Enum
 
 import codecs
+import gzip
+import bz2
+import lzma
 import urllib.parse
 import urllib.request
 
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # rb2tk
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 RB2TK_VERSION = "0.1.0"
 
+PARALLEL_MIN_TRACKS = 5000
+""" Smaller collections are parsed serially; not worth the process pool start-up. """
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # Cue & GridMarker
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 class Cue:
+    __slots__ = ("name", "start", "len", "num", "type")
+
     class Type(Enum):
         """
         Most cue types can be inferred:
@@ -61,6 +86,8 @@ class Cue:
 
 
 class GridMarker:
+    __slots__ = ("start", "bpm", "timesig", "beat")
+
     def __init__(self):
         self.start = 0.0
         self.bpm = 0.0
@@ -92,6 +119,11 @@ class Track:
         self.grids = []
         self.indate = ""
         self.rating = 0
+        self.bitrate = 0
+        """ bits/s; 0 = unknown """
+        self.samplerate = 0
+        self.playtime = 0.0
+        """ Exact duration in seconds, as probed from the audio file; 0.0 = unknown """
 
     def __str__(self):
         return "{}:\t{} ({} :: {}) [{}, {}, {} cue(s), {} grid(s)]" \
@@ -107,25 +139,42 @@ class Playlist:
         Folder = 0
         List = 1
 
+    DUP_SEP = "\x1e"
+
     def __init__(self):
         self.name = ""
         self.type = Playlist.Type.Folder
         self.children = []
 
     def __str__(self):
-        return self.__str_recursive(0)
+        lines = []
+        stack = [(self, 0)]
+        while stack:
+            p, level = stack.pop()
+            if p.type == Playlist.Type.Folder:
+                lines.append("{}[{}]".format(' '*2*level, p.name))
+                stack.extend((c, level + 1) for c in reversed(p.children))
+            elif p.type == Playlist.Type.List:
+                lines.append("{}{} ({} tracks)".format(' '*2*level, p.name, len(p.children)))
+        return "\n".join(lines)
 
-    def __str_recursive(self, level):
-        s = ""
-        if self.type == Playlist.Type.Folder:
-            s = "{}[{}]".format(' '*2*level, self.name)
-            for c in self.children:
-                s = s + "\n" + c.__str_recursive(level + 1)
-        elif self.type == Playlist.Type.List:
-            s = "{}{} ({} tracks)".format(' '*2*level, self.name, len(self.children))
-            # for c in self.children:
-            #     s = s + "\n{}- {}".format(' '*2*level, c)
-        return s
+    @staticmethod
+    def child_keys(names : list) -> list:
+        """
+        Keys identifying each of a list of sibling nodes: its name, plus an occurrence count for duplicate names.
+        """
+        seen = {}
+        keys = []
+        for name in names:
+            n = seen.get(name, 0)
+            seen[name] = n + 1
+            keys.append(name if n == 0 else f"{name}{Playlist.DUP_SEP}{n}")
+        return keys
+
+    @staticmethod
+    def key_name(key : str) -> str:
+        """ Name of the node identified by a key from child_keys(). """
+        return key.split(Playlist.DUP_SEP)[0]
 
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -135,9 +184,133 @@ class Library:
     def __init__(self):
         self.track_dict = {}
         self.playl_tree = None
+        self.playl_selection = None
+        """
+        Exported playlists (or folders) by path, as Playlist.child_keys() of each level in the full tree;
+        None = full export.
+        """
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# XmlBackend
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+class XmlBackend:
+    """
+    Thin wrapper around the XML implementation: lxml (C-level parsing, XPath lookups and
+    indentation) if it is installed, xml.etree.ElementTree otherwise. Selected with the
+    'XmlBackend' option (auto/lxml/stdlib). Both produce equivalent output.
+    """
+    def __init__(self, choice : str = "auto"):
+        """ @param choice   auto, lxml or stdlib. """
+        choice = choice.lower()
+        if choice == "lxml" and lxml_etree is None:
+            logging.warning("lxml isn't installed, using the standard library XML backend.")
+        self.is_lxml = lxml_etree is not None and choice in ("auto", "lxml")
+        self.name = "lxml" if self.is_lxml else "stdlib"
+        self.etree = lxml_etree if self.is_lxml else ET
+        self._xpaths = {}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get("Options", "XmlBackend", fallback="auto"))
+
+    def _parser(self):
+        return lxml_etree.XMLParser(remove_blank_text=True, huge_tree=True)
+
+    def parse(self, source):
+        """ Parses a file (path or file object), returns its root element. """
+        if self.is_lxml:
+            return lxml_etree.parse(source, self._parser()).getroot()
+        return ET.parse(source).getroot()
+
+    def fromstring(self, data : bytes):
+        if self.is_lxml:
+            return lxml_etree.fromstring(data, self._parser())
+        return ET.fromstring(data)
+
+    def Element(self, tag : str, attrib : dict = {}):
+        return self.etree.Element(tag, attrib)
+
+    def SubElement(self, parent, tag : str, attrib : dict = {}):
+        return self.etree.SubElement(parent, tag, attrib)
+
+    @staticmethod
+    def set_attrib(elem, attrib : dict):
+        """ Replaces all attributes of an element (lxml doesn't allow assigning .attrib). """
+        elem.attrib.clear()
+        elem.attrib.update(attrib)
+
+    def findall(self, elem, path : str) -> list:
+        """ Finds all elements matching a simple relative path, e.g. 'SUBNODES/NODE'. """
+        if self.is_lxml:
+            if path not in self._xpaths:
+                self._xpaths[path] = lxml_etree.XPath(path)
+            return self._xpaths[path](elem)
+        return elem.findall(path)
+
+    def iterparse(self, source, events=("start", "end")):
+        if self.is_lxml:
+            return lxml_etree.iterparse(source, events=events, remove_blank_text=True, huge_tree=True)
+        return ET.iterparse(source, events)
+
+    def tostring(self, elem, level=0) -> bytes:
+        """ Serializes an element (without its tail), indented as if it were at the given depth. """
+        elem.tail = None
+        if self.is_lxml:
+            lxml_etree.indent(elem, space="  ", level=level)
+        else:
+            Utils.xml_indent(elem, level)
+        elem.tail = None
+        return b"  "*level + self.etree.tostring(elem, encoding='utf-8') + b"\n"
+
+    def start_tag(self, tag : str, attrib : dict, level=0) -> bytes:
+        """ Serializes only the (escaped) opening tag of an element. """
+        elem = self.etree.Element(tag, attrib)
+        elem.text = ""
+        if self.is_lxml:
+            data = lxml_etree.tostring(elem, encoding='utf-8')
+        else:
+            data = ET.tostring(elem, encoding='utf-8', short_empty_elements=False)
+        return b"  "*level + data[:-len(f"</{tag}>")] + b"\n"
+
+    def write(self, root, dest) -> bool:
+        """ Indents and serializes a document to a file (path or binary file object). """
+        if self.is_lxml:
+            lxml_etree.indent(root, space="  ")
+            lxml_etree.ElementTree(root).write(dest, encoding='utf-8', xml_declaration=True)
+            return True
+        Utils.xml_indent(root)
+        return ET.ElementTree(root).write(dest, encoding='utf-8', xml_declaration=True) is None
 
 
 class Utils:
+    compressors = {"gz": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+
+    @staticmethod
+    def is_compressed(path : str) -> bool:
+        return Utils._get_decompressor(path) is not None
+
+    @staticmethod
+    def _get_decompressor(path : str):
+        """ Detects gzip, bzip2 and xz files by their magic bytes, rather than their extension. """
+        with open(path, 'rb') as f:
+            magic = f.read(6)
+        if magic[:2] == b"\x1f\x8b":
+            return gzip.open
+        if magic[:3] == b"BZh":
+            return bz2.open
+        if magic == b"\xfd7zXZ\x00":
+            return lzma.open
+        return None
+
+    @staticmethod
+    def open_input(path : str):
+        """
+        Opens a file for (binary) reading, transparently decompressing it on the fly if needed.
+        """
+        decompressor = Utils._get_decompressor(path)
+        return decompressor(path, 'rb') if decompressor is not None else open(path, 'rb')
+
     @staticmethod
     def url2path(url : str) -> str:
         ourl = urllib.parse.urlparse(url)
@@ -146,22 +319,21 @@ class Utils:
         return path
     
     @staticmethod
-    # Method happily lifted from https://stackoverflow.com/a/4590052
+    # Method happily lifted from https://stackoverflow.com/a/4590052 (made iterative)
     def xml_indent(elem: ET.Element, level=0):
-        i = "\n" + level*"  "
-        j = "\n" + (level-1)*"  "
-        if len(elem):
-            if not elem.text or not elem.text.strip():
-                elem.text = i + "  "
-            if not elem.tail or not elem.tail.strip():
-                elem.tail = i
-            for subelem in elem:
-                Utils.xml_indent(subelem, level+1)
-            if not elem.tail or not elem.tail.strip():
-                elem.tail = j
-        else:
-            if level and (not elem.tail or not elem.tail.strip()):
-                elem.tail = j
+        stack = [(elem, level)]
+        while stack:
+            e, lvl = stack.pop()
+            i = "\n" + lvl*"  "
+            j = "\n" + (lvl-1)*"  "
+            if len(e):
+                if not e.text or not e.text.strip():
+                    e.text = i + "  "
+                if not e.tail or not e.tail.strip():
+                    e.tail = j
+                stack.extend((subelem, lvl+1) for subelem in e)
+            elif lvl and (not e.tail or not e.tail.strip()):
+                e.tail = j
         return elem
     
     @staticmethod
@@ -175,13 +347,212 @@ class Utils:
             logging.info(f"Backup file created: {bak_filename}")
 
 
+class TeeWriter:
+    """
+    Binary file-like object duplicating everything written to it, e.g. into a compressed copy.
+    """
+    def __init__(self, *files):
+        self.files = files
+
+    def write(self, data) -> int:
+        for f in self.files:
+            f.write(data)
+        return len(data)
+
+    def flush(self):
+        for f in self.files:
+            f.flush()
+
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-# RekordboxReader
+# Metrics
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+class Metrics:
+    """
+    Counters and timers collected by the stages during a run, e.g. for monitoring scheduled syncs.
+    Saved as JSON and/or as a Prometheus textfile-collector file.
+    """
+    COUNTERS = ("tracks_read", "tracks_pruned", "duplicates_removed", "grid_markers_removed",
+                "tracks_added", "tracks_updated", "tracks_locked_skipped", "tracks_moved", "entries_removed",
+                "playlist_subtrees_kept", "playlist_subtrees_rebuilt",
+                "collection_index_hits", "collection_index_misses",
+                "audio_probe_cache_hits", "audio_probe_cache_misses", "hash_cache_hits", "hash_cache_misses")
+    """ Known counters; all of them are reported, as 0 if the run didn't touch them. """
+
+    def __init__(self):
+        self.counters = collections.Counter(dict.fromkeys(self.COUNTERS, 0))
+        self.duration = 0.0
+        """ Duration of the whole run in seconds. """
+        self.phases = collections.defaultdict(float)
+        """ Durations in seconds of the top-level parts of the run (Read, Operations, Plan, Write). """
+        self.timers = collections.defaultdict(float)
+        """ Durations in seconds, by stage name; stages run within the phases. """
+        self.__lock = threading.Lock()
+
+    def add(self, name : str, n : int = 1):
+        with self.__lock:
+            self.counters[name] += n
+
+    def add_time(self, name : str, seconds : float):
+        with self.__lock:
+            self.timers[name] += seconds
+
+    @contextlib.contextmanager
+    def run(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.duration = time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def phase(self, name : str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.__lock:
+                self.phases[name] += time.perf_counter() - start
+
+    def to_dict(self, success : bool) -> dict:
+        return {"version": RB2TK_VERSION,
+                "timestamp": time.time(),
+                "success": success,
+                "duration": self.duration,
+                "counters": dict(sorted(self.counters.items())),
+                "phases": dict(self.phases),
+                "timers": dict(sorted(self.timers.items()))}
+
+    def to_prometheus(self, success : bool) -> str:
+        """
+        Counters are exported as gauges, since every run overwrites the file.
+        Phases and stages are separate families, so that summing either doesn't count time twice.
+        """
+        def metric_name(name):
+            return "rb2tk_" + re.sub(r"[^a-zA-Z0-9_]", "_", name).lower()
+
+        def label(value):
+            return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+        lines = ["# HELP rb2tk_last_run_timestamp_seconds Time of the last run.",
+                 "# TYPE rb2tk_last_run_timestamp_seconds gauge",
+                 f"rb2tk_last_run_timestamp_seconds {time.time():.3f}",
+                 "# HELP rb2tk_last_run_success Whether the last run succeeded.",
+                 "# TYPE rb2tk_last_run_success gauge",
+                 f"rb2tk_last_run_success {1 if success else 0}",
+                 "# HELP rb2tk_last_run_duration_seconds Duration of the last run.",
+                 "# TYPE rb2tk_last_run_duration_seconds gauge",
+                 f"rb2tk_last_run_duration_seconds {self.duration:.6f}"]
+        for name, value in sorted(self.counters.items()):
+            lines += [f"# TYPE {metric_name(name)} gauge", f"{metric_name(name)} {value}"]
+        if len(self.phases) > 0:
+            lines += ["# HELP rb2tk_phase_duration_seconds Time spent in each phase of the last run.",
+                      "# TYPE rb2tk_phase_duration_seconds gauge"]
+            lines += [f'rb2tk_phase_duration_seconds{{phase="{label(name)}"}} {value:.6f}'
+                      for name, value in sorted(self.phases.items())]
+        if len(self.timers) > 0:
+            lines += ["# HELP rb2tk_stage_duration_seconds Time spent in each stage of the last run (within its phase).",
+                      "# TYPE rb2tk_stage_duration_seconds gauge"]
+            lines += [f'rb2tk_stage_duration_seconds{{stage="{label(name)}"}} {value:.6f}'
+                      for name, value in sorted(self.timers.items())]
+        return "\n".join(lines) + "\n"
+
+    def save(self, config, success : bool):
+        """
+        Writes the metrics to the paths configured as MetricsJson and MetricsPrometheus, if any.
+        Each file is replaced atomically, so collectors never read a partial file.
+        """
+        outputs = [(config.get("Options", "MetricsJson", fallback=""),
+                    lambda: json.dumps(self.to_dict(success), indent=2)),
+                   (config.get("Options", "MetricsPrometheus", fallback=""),
+                    lambda: self.to_prometheus(success))]
+        for path, render in outputs:
+            if path == "":
+                continue
+            try:
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    f.write(render())
+                os.replace(path + ".tmp", path)
+            except OSError as e:
+                logging.warning(f"Failed to save metrics to {path}: {e}")
+
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-class RekordboxReader:
-    def __init__(self, config):
+# Stage
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+class Cancelled(Exception):
+    """ Raised at a checkpoint once a run has been cancelled. """
+    pass
+
+
+class CancelToken:
+    """
+    Cooperative cancellation flag, shared between a controlling thread and the stages.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled()
+
+
+class Stage:
+    """
+    Common base of the conversion stages (reader, operations, writer).
+    """
+    def __init__(self, config, progress=None, cancel=None, metrics=None):
         self.config = config
-        pass
+        self.progress = progress
+        """ Optional callable(stage : str, done : int, total : int), e.g. to feed a progress bar. """
+        self.cancel = cancel
+        """ Optional CancelToken, checked at track and playlist granularity. """
+        self.metrics = metrics if metrics is not None else Metrics()
+        """ Metrics of the run; shared between stages if given. """
+
+    def _checkpoint(self):
+        if self.cancel is not None:
+            self.cancel.check()
+
+    def _report(self, stage : str, done : int, total : int):
+        if self.progress is not None:
+            self.progress(stage, done, total)
+
+    def _iter_progress(self, stage : str, items):
+        """
+        Iterates over a sized collection, reporting progress at most ~100 times.
+        The time spent is added to the stage's timer.
+        """
+        total = len(items)
+        step = max(1, total // 100)
+        start = time.perf_counter()
+        for i, item in enumerate(items):
+            self._checkpoint()
+            if i % step == 0:
+                self._report(stage, i, total)
+            yield item
+        self._report(stage, total, total)
+        self.metrics.add_time(stage, time.perf_counter() - start)
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# RekordboxReader
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+class RekordboxReader(Stage):
+    __track_re = re.compile(rb"<TRACK[\s/>]")
+
+    def __init__(self, config, progress=None, cancel=None, metrics=None):
+        super().__init__(config, progress, cancel, metrics)
+        self.xml = XmlBackend.from_config(config)
+        self._root = None
+        """ Parsed document, shared by the serial track and playlist parsing. """
 
     def read(self, path_xml : str) -> Library:
         l = Library()
@@ -189,46 +560,238 @@ class RekordboxReader:
             logging.error("File doesn't exist: {}".format(path_xml))
         else:
             logging.debug("Reading: {}".format(path_xml))
-            l.track_dict = self._parse_tracks(path_xml)
-            l.playl_tree = self._parse_playlists(path_xml)
+            sections = self._scan_sections(path_xml) if self._get_parse_workers() > 1 else None
+            track_ids = None
+
+            patterns = self._get_playlist_patterns()
+            if len(patterns) > 0:
+                # The selected track IDs are needed before parsing tracks.
+                l.playl_tree = self._parse_playlists(path_xml, sections)
+                if l.playl_tree is not None:
+                    l.playl_selection = {}
+                    l.playl_tree = self._select_nodes(l.playl_tree, patterns, l.playl_selection)
+                    track_ids = self._collect_track_ids(l.playl_tree)
+                    if len(l.playl_selection) == 0:
+                        logging.warning("No playlists match: {}".format(", ".join(patterns)))
+                    logging.info(f"Partial export: {len(l.playl_selection)} playlist(s), {len(track_ids)} track(s).")
+
+            if sections is None or len(sections["tracks"]) < PARALLEL_MIN_TRACKS:
+                if len(patterns) == 0:
+                    l.playl_tree = self._parse_playlists(path_xml, sections)
+                l.track_dict = self._parse_tracks(path_xml, track_ids)
+            else:
+                pool, shards = self._submit_track_shards(path_xml, sections, track_ids)
+                try:
+                    if len(patterns) == 0:
+                        # Parsed while the workers are busy with the tracks.
+                        l.playl_tree = self._parse_playlists(path_xml, sections)
+                    l.track_dict = self._collect_track_shards(shards)
+                finally:
+                    pool.shutdown(wait=True, cancel_futures=True)
+            self.metrics.add("tracks_read", len(l.track_dict))
+            self._root = None
         return l
 
-    def _parse_tracks(self, path_xml):
-        tree = ET.parse(path_xml)
-        root = tree.getroot()
+    def _get_root(self, path_xml : str):
+        """
+        Parses the whole document once (decompressing it on the fly, if needed).
+        """
+        if self._root is None:
+            with Utils.open_input(path_xml) as f:
+                self._root = self.xml.parse(f)
+        return self._root
+
+    def _get_parse_workers(self) -> int:
+        """
+        Number of processes used to parse the COLLECTION (0 = one per CPU, 1 = parse serially).
+        """
+        workers = self.config.getint("Options", "ParseWorkers", fallback=0)
+        return workers if workers > 0 else (os.cpu_count() or 1)
+
+    def _scan_sections(self, path_xml : str) -> dict:
+        """
+        Scans the raw file once for the byte offsets of the TRACK elements in the COLLECTION and
+        of the PLAYLISTS section, without parsing it.
+        @return {"tracks": [offsets], "tracks_end": offset, "playlists": (start, end)}, or None if
+                the file can't be sharded (e.g., it's compressed, isn't UTF-8 or the sections can't be found).
+        """
+        if Utils.is_compressed(path_xml):
+            return None
+        with open(path_xml, 'rb') as f:
+            head = f.read(256)
+            decl = re.match(rb'<\?xml[^>]*encoding=["\']([A-Za-z0-9_.-]+)["\']', head.lstrip(codecs.BOM_UTF8))
+            if decl is not None and decl.group(1).lower() not in (b"utf-8", b"utf8"):
+                return None
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                coll_start = mm.find(b"<COLLECTION")
+                coll_end = mm.find(b"</COLLECTION>", max(coll_start, 0))
+                playl_start = mm.find(b"<PLAYLISTS", max(coll_end, 0))
+                playl_end = mm.rfind(b"</PLAYLISTS>")
+                if min(coll_start, coll_end, playl_start, playl_end) < 0:
+                    return None
+
+                tracks = [m.start() for m in self.__track_re.finditer(mm, coll_start, coll_end)]
+                return {"tracks": tracks,
+                        "tracks_end": coll_end,
+                        "playlists": (playl_start, playl_end + len(b"</PLAYLISTS>"))}
+
+    def _submit_track_shards(self, path_xml : str, sections : dict, track_ids : set = None):
+        """
+        Splits the TRACK elements into contiguous byte ranges, and parses them in a process pool.
+        @return (pool, futures), futures in document order.
+        """
+        offsets = sections["tracks"]
+        workers = min(self._get_parse_workers(), len(offsets))
+        n_shards = min(workers * 4, len(offsets))
+        bounds = [offsets[i * len(offsets) // n_shards] for i in range(n_shards)] + [sections["tracks_end"]]
+
+        logging.debug(f"Parsing {len(offsets)} tracks in {n_shards} shards on {workers} processes.")
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        futures = [pool.submit(_parse_track_shard, path_xml, bounds[i], bounds[i + 1], track_ids, self.xml.name)
+                   for i in range(n_shards)]
+        return pool, futures
+
+    def _collect_track_shards(self, futures : list) -> dict:
+        tracks = {}
+        for i, future in enumerate(futures):
+            self._report("Reading tracks", i, len(futures))
+            while True:
+                self._checkpoint()
+                try:
+                    shard = future.result(timeout=0.1)
+                    break
+                except concurrent.futures.TimeoutError:
+                    continue
+            for t in shard:
+                # Unpickling creates new copies of the strings the worker had interned.
+                self._intern_track(t)
+                tracks[t.id] = t
+        self._report("Reading tracks", len(futures), len(futures))
+
+        logging.debug("{} tracks found.".format(len(tracks)))
+        return tracks
+
+    def _get_playlist_patterns(self) -> list:
+        """
+        Playlist path globs (one per line, e.g. 'Gigs/Gig 2026-*') selecting a partial export.
+        """
+        patterns = self.config.get("Library", "ExportPlaylists", fallback="")
+        return [p.strip().strip('/') for p in patterns.splitlines() if p.strip() != ""]
+
+    def _select_nodes(self, playl_root : Playlist, patterns : list, selection : dict) -> Playlist:
+        """
+        Prunes the playlist tree down to the nodes matching any of the path globs (plus their ancestors).
+        @param playl_root   Root Playlist node.
+        @param patterns     Playlist path globs, matched against names below the 'ROOT' node.
+        @param selection    Output {path: node} of the matched nodes, in document order. Paths are made of
+                            the Playlist.child_keys() of each level of the full tree, so that siblings with
+                            the same name are told apart.
+        @return Pruned copy of the tree (matched subtrees are shared, not copied).
+        """
+        matches = []
+        keys = Playlist.child_keys([c.name for c in playl_root.children])
+        stack = [(c, (c,), (k,)) for c, k in reversed(list(zip(playl_root.children, keys)))]
+        while stack:
+            playl, chain, keypath = stack.pop()
+            path = tuple(p.name for p in chain)
+            if any(fnmatch.fnmatchcase("/".join(path), p) for p in patterns):
+                selection[keypath] = playl
+                matches.append(chain)
+            elif playl.type == Playlist.Type.Folder:
+                keys = Playlist.child_keys([c.name for c in playl.children])
+                stack.extend((c, chain + (c,), keypath + (k,)) for c, k in reversed(list(zip(playl.children, keys))))
+
+        def copy_folder(playl):
+            p = Playlist()
+            p.name = playl.name
+            p.type = playl.type
+            return p
+
+        root = copy_folder(playl_root)
+        copies = {}
+        for chain in matches:
+            parent = root
+            for folder in chain[:-1]:
+                if id(folder) not in copies:
+                    copies[id(folder)] = copy_folder(folder)
+                    parent.children.append(copies[id(folder)])
+                parent = copies[id(folder)]
+            parent.children.append(chain[-1])
+
+        return root
+
+    def _collect_track_ids(self, playl_root : Playlist) -> set:
+        track_ids = set()
+        stack = [playl_root] if playl_root is not None else []
+        while stack:
+            playl = stack.pop()
+            if playl.type == Playlist.Type.List:
+                track_ids.update(playl.children)
+            else:
+                stack.extend(playl.children)
+        return track_ids
+
+    def _parse_tracks(self, path_xml, track_ids : set = None):
+        root = self._get_root(path_xml)
         tracks = {}
 
         coll_elem = root.find('COLLECTION')
-        for track_elem in coll_elem.iter('TRACK'):
-            a = track_elem.attrib
-            t = Track()
-            t.id = a['TrackID']
-            t.name = a['Name']
-            t.artist = a['Artist']
-            t.bpm = float(a['AverageBpm'])
-            t.duration = float(a['TotalTime'])
-            t.genre = a['Genre']
-            t.comments = a['Comments']
-            t.tonality = a['Tonality']
-            t.fileurl = a['Location']
-            t.album = a['Album']
-            t.indate = a['DateAdded']
-            t.rating = a['Rating']
-            t.label = a['Label']
-
-            for mark_elem in track_elem.iter('POSITION_MARK'):
-                t.cues.append(self._make_cue(mark_elem.attrib))
-
-            for tempo_elem in track_elem.iter('TEMPO'):
-                t.grids.append(self._make_grid_marker(tempo_elem.attrib))
-
-            t.cues.sort(key=lambda c: c.start)
+        for track_elem in self._iter_progress("Reading tracks", coll_elem.findall('TRACK')):
+            if track_ids is not None and track_elem.attrib['TrackID'] not in track_ids:
+                continue
+            t = self._make_track(track_elem)
             tracks[t.id] = t
 
         logging.debug("{} tracks found.".format(len(tracks)))
         return tracks
 
-    def _make_cue(self, cue_dict) -> Cue:
+    @staticmethod
+    def _make_track(track_elem) -> Track:
+        a = track_elem.attrib
+        t = Track()
+        t.id = a['TrackID']
+        t.name = a['Name']
+        t.artist = a['Artist']
+        t.bpm = float(a['AverageBpm'])
+        t.duration = float(a['TotalTime'])
+        t.genre = a['Genre']
+        t.comments = a['Comments']
+        t.tonality = a['Tonality']
+        t.fileurl = a['Location']
+        t.album = a['Album']
+        t.indate = a['DateAdded']
+        t.rating = a['Rating']
+        t.label = a['Label']
+        t.bitrate = int(a.get('BitRate') or 0) * 1000
+        t.samplerate = int(a.get('SampleRate') or 0)
+        RekordboxReader._intern_track(t)
+
+        for mark_elem in track_elem.iter('POSITION_MARK'):
+            t.cues.append(RekordboxReader._make_cue(mark_elem.attrib))
+
+        for tempo_elem in track_elem.iter('TEMPO'):
+            t.grids.append(RekordboxReader._make_grid_marker(tempo_elem.attrib))
+
+        t.cues.sort(key=lambda c: c.start)
+        return t
+
+    @staticmethod
+    def _intern_track(t : Track):
+        """
+        Shares the strings that repeat a lot across a library (artists, albums, etc.) between tracks.
+        """
+        t.artist = sys.intern(t.artist)
+        t.album = sys.intern(t.album)
+        t.genre = sys.intern(t.genre)
+        t.label = sys.intern(t.label)
+        t.tonality = sys.intern(t.tonality)
+        t.indate = sys.intern(t.indate)
+
+    @staticmethod
+    def _make_cue(cue_dict) -> Cue:
         c = Cue()
         c.start = float(cue_dict['Start'])
         c.len = (float(cue_dict['End']) - c.start) if 'End' in cue_dict else 0.0
@@ -237,7 +800,8 @@ class RekordboxReader:
         c.type = Cue.Type.Cue
         return c
 
-    def _make_grid_marker(self, marker_dict) -> Cue:
+    @staticmethod
+    def _make_grid_marker(marker_dict) -> Cue:
         g = GridMarker()
         g.start   = float(marker_dict['Inizio'])
         g.bpm     = float(marker_dict['Bpm'])
@@ -245,55 +809,657 @@ class RekordboxReader:
         g.timesig = [int(x) for x in marker_dict['Metro'].split("/")]
         return g
 
-    def _parse_playlists(self, path_xml) -> Playlist:
-        tree = ET.parse(path_xml)
-        root = tree.getroot()
+    def _parse_playlists(self, path_xml, sections : dict = None) -> Playlist:
         playl_root = None
 
-        playl_elem = root.find('PLAYLISTS')
-        for child in playl_elem:
-            playl_root = self._make_node_recursive(child)
+        if sections is not None:
+            # Only parse the PLAYLISTS section:
+            start, end = sections["playlists"]
+            with open(path_xml, 'rb') as f:
+                f.seek(start)
+                playl_elem = self.xml.fromstring(f.read(end - start))
+        else:
+            playl_elem = self._get_root(path_xml).find('PLAYLISTS')
+
+        for child in playl_elem.findall('NODE'):
+            playl_root = self._make_tree(child)
 
         return playl_root
 
-    def _make_node_recursive(self, node_elem) -> Playlist:
-        a = node_elem.attrib
-        p = Playlist()
-        p.name = a['Name']
-        p.type = Playlist.Type.Folder if a['Type'] == "0" else Playlist.Type.List
+    def _make_tree(self, node_elem) -> Playlist:
+        """
+        Builds the Playlist tree below a NODE element (depth-first, with an explicit stack).
+        """
+        root = None
+        stack = [(node_elem, None)]
+        while stack:
+            self._checkpoint()
+            elem, parent = stack.pop()
+            a = elem.attrib
+            p = Playlist()
+            p.name = a['Name']
+            p.type = Playlist.Type.Folder if a['Type'] == "0" else Playlist.Type.List
+
+            if parent is None:
+                root = p
+            else:
+                parent.children.append(p)
+
+            if p.type == Playlist.Type.List:
+                p.children = [t_e.attrib['Key'] for t_e in elem if t_e.tag == "TRACK"]
+            else:
+                stack.extend((n_e, p) for n_e in reversed(elem.findall("NODE")))
+
+        return root
+
+
+def _parse_track_shard(path_xml : str, start : int, end : int, track_ids : set = None, backend="stdlib") -> list:
+    """
+    Process pool worker: parses the TRACK elements within a byte range of the COLLECTION.
+    @param backend  XmlBackend choice, as resolved by the parent process (lxml/stdlib).
+    """
+    with open(path_xml, 'rb') as f:
+        f.seek(start)
+        coll_elem = XmlBackend(backend).fromstring(b"<COLLECTION>" + f.read(end - start) + b"</COLLECTION>")
+
+    return [RekordboxReader._make_track(e) for e in coll_elem.findall('TRACK')
+            if track_ids is None or e.attrib['TrackID'] in track_ids]
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# CollectionIndex
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+class CollectionOutOfSync(Exception):
+    """ Raised when a collection no longer matches what was scanned or indexed of it. """
+    pass
+
+
+class CollectionIndex:
+    """
+    Sidecar index of a Traktor collection, stored next to it as '<collection>.rb2tk-index.json'.
+    Holds the byte range, LOCATION and LOCK state of every COLLECTION ENTRY, and the byte range
+    of the PLAYLISTS section. It is keyed by the size and mtime of the collection, and rebuilt
+    with a raw byte scan (no XML parsing) once they change.
+    """
+    VERSION = 3
+    Entry = collections.namedtuple("Entry", ["offset", "length", "file", "lock", "volume", "dir"])
+
+    __entry_re = re.compile(rb"<ENTRY[\s/>]")
+    __location_re = re.compile(rb"<LOCATION\s([^>]*)>")
+    __lock_re = re.compile(rb"\sLOCK=[\"']([^\"']*)[\"']")
+    __attrib_re = re.compile(rb"([\w:-]+)=(?:\"([^\"]*)\"|'([^']*)')")
+    __playlists_re = re.compile(rb"<PLAYLISTS\b[^>]*?(/?)>")
+
+    def __init__(self, path_nml : str):
+        self.path = path_nml
+        self.size = -1
+        self.mtime = -1
+        self.entries = []
+        self.playlists = None
+        """ (start, end) byte range of the PLAYLISTS element, if any. """
+        self.from_cache = False
+        """ Whether the index was loaded from its sidecar, rather than rebuilt. """
+
+    @staticmethod
+    def sidecar_path(path_nml : str) -> str:
+        return path_nml + ".rb2tk-index.json"
+
+    @staticmethod
+    def discard(path_nml : str):
+        """ Removes the sidecar index of a collection, if any, so that it's rebuilt next time. """
+        try:
+            os.remove(CollectionIndex.sidecar_path(path_nml))
+        except OSError:
+            pass
 
-        for t_e in node_elem: # iterate over children
-            if p.type == Playlist.Type.List and t_e.tag == "TRACK":
-                p.children.append(t_e.attrib['Key'])
-            elif p.type == Playlist.Type.Folder and t_e.tag == "NODE":
-                p.children.append(self._make_node_recursive(t_e))
+    @staticmethod
+    def make_key(volume : str, dir : str, file : str) -> str:
+        """ Normalized location key, as used by PRIMARYKEY elements. """
+        return unicodedata.normalize("NFC", volume + dir + file)
 
-        return p
+    @classmethod
+    def load_or_build(cls, path_nml : str):
+        """
+        Loads the sidecar index of a collection if it's still current, rebuilds (and saves) it otherwise.
+        @return CollectionIndex, or None if the collection can't be indexed (e.g. it's truncated).
+        """
+        index = cls(path_nml)
+        st = os.stat(path_nml)
+        try:
+            with open(cls.sidecar_path(path_nml), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data["version"] == cls.VERSION and data["size"] == st.st_size and data["mtime"] == st.st_mtime_ns:
+                index.size, index.mtime = data["size"], data["mtime"]
+                index.entries = [cls.Entry(*e) for e in data["entries"]]
+                index.playlists = tuple(data["playlists"]) if data["playlists"] is not None else None
+                index.from_cache = True
+                logging.debug(f"Using collection index: {cls.sidecar_path(path_nml)}")
+                return index
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        logging.debug(f"Rebuilding collection index of: {path_nml}")
+        try:
+            index.build()
+        except ValueError as e:
+            logging.warning(f"Can't index collection, parsing it instead: {e}")
+            return None
+        index.save()
+        return index
+
+    def build(self):
+        st = os.stat(self.path)
+        self.size, self.mtime = st.st_size, st.st_mtime_ns
+        self.entries = []
+        self.playlists = None
+        if self.size == 0:
+            return
+
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            coll_start = mm.find(b"<COLLECTION")
+            coll_end = mm.find(b"</COLLECTION>", max(coll_start, 0))
+            if coll_start >= 0 and coll_end >= 0:
+                for m in self.__entry_re.finditer(mm, coll_start, coll_end):
+                    start = m.start()
+                    tag_end = mm.find(b">", start)
+                    if tag_end < 0:
+                        raise ValueError(f"Unterminated ENTRY at byte {start}")
+                    if mm[tag_end - 1] == ord("/"):
+                        end = tag_end + 1
+                    else:
+                        end = mm.find(b"</ENTRY>", start)
+                        if end < 0:
+                            raise ValueError(f"Unterminated ENTRY at byte {start}")
+                        end += len(b"</ENTRY>")
+                    data = mm[start:end]
+
+                    lock = self.__lock_re.search(data, 0, tag_end + 1 - start)
+                    loc = {}
+                    location = self.__location_re.search(data)
+                    if location is not None:
+                        for a in self.__attrib_re.finditer(location.group(1)):
+                            value = a.group(2) if a.group(2) is not None else a.group(3)
+                            loc[a.group(1).decode('utf-8')] = html.unescape(value.decode('utf-8'))
+
+                    self.entries.append(self.Entry(start, end - start, loc.get("FILE", ""),
+                                                   lock.group(1).decode('utf-8') if lock is not None else "",
+                                                   loc.get("VOLUME", ""), loc.get("DIR", "")))
+
+            m = self.__playlists_re.search(mm, max(coll_end, 0))
+            if m is not None:
+                end = m.end() if m.group(1) == b"/" else mm.rfind(b"</PLAYLISTS>") + len(b"</PLAYLISTS>")
+                self.playlists = (m.start(), end) if end > m.start() else None
+
+    def save(self):
+        data = {"version": self.VERSION, "size": self.size, "mtime": self.mtime,
+                "playlists": self.playlists, "entries": [list(e) for e in self.entries]}
+        try:
+            with open(self.sidecar_path(self.path), "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+        except OSError as e:
+            logging.warning(f"Failed to save collection index: {e}")
 
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # TraktorWriter
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-class TraktorWriter:
-    def __init__(self, config):
-        self.config = config
+class TraktorWriter(Stage):
+    # Attribute strings shared by all cues.
+    __cue_types = {t: str(t.value) for t in Cue.Type}
+    __hotcues = {n: str(n) for n in range(-1, 8)}
+    __zero_len = str(0.0)
+
+    def __init__(self, config, progress=None, cancel=None, metrics=None):
+        super().__init__(config, progress, cancel, metrics)
+        self.xml = XmlBackend.from_config(config)
         self.volume = ""
         self.__sep = "/:"
+        self.__path_sep = "\x1f"
+        self._output_path = ""
+        self._playlist_fps = None
+        """ Playlist fingerprints of the rendered output, saved once it has been written. """
+        self.__locations = {}
+        """ LOCATION attributes by file URL """
+        self.__dirs = {}
+        """ DIR attribute by directory """
         pass
 
     def write(self, lib : Library, path_xml : str) -> bool:
-        root = self._init_dom(path_xml)
-        if root is None or path_xml == '':
+        if path_xml == '':
             return False
-        root = self._render_tracks(root, lib)
-        root = self._render_playlists(root, lib)
-        wrok = self._write_to_output(path_xml, root)
+        self._output_path = path_xml
+        self._playlist_fps = None
+        if lib.playl_selection is not None and not (self.config.getboolean("Library", "MergeOutput", fallback=True)
+                                                    and os.path.exists(path_xml)):
+            logging.warning("Partial export without an existing collection to merge into: "
+                            "the output will only contain the selected playlists and their tracks.")
+
+        streaming = self.config.getboolean("Library", "StreamingMerge", fallback=False) \
+            and self.config.getboolean("Library", "MergeOutput", fallback=True) \
+            and os.path.exists(path_xml)
+        scan = self._scan_collection(path_xml) if streaming else None
+
+        # Write to a temporary file first, so that a cancelled or failed run leaves
+        # the existing collection (and its backups) untouched.
+        tmp_path = path_xml + ".tmp"
+        archive_path = self._get_archive_path(path_xml)
+        try:
+            wrok = None
+            if scan is not None:
+                self._report("Writing output", 0, 1)
+                counters = collections.Counter(self.metrics.counters)
+                try:
+                    with self._open_output(tmp_path, archive_path) as out:
+                        wrok = self._stream_merge(lib, path_xml, out, scan)
+                except CollectionOutOfSync as e:
+                    logging.warning(f"{e}, falling back to a regular merge.")
+                    self.metrics.counters = counters
+                    CollectionIndex.discard(path_xml)
+
+            if wrok is None:
+                root = self._init_dom(path_xml)
+                if root is None:
+                    return False
+                root = self._render_tracks(root, lib)
+                self._report("Rendering playlists", 0, 1)
+                root = self._render_playlists(root, lib)
+                if self._use_compaction():
+                    root = self._compact_collection(root, lib)
+                self._report("Writing output", 0, 1)
+                with self._open_output(tmp_path, archive_path) as out:
+                    wrok = self._write_to_output(out, root)
+            self._checkpoint()
+            if wrok:
+                if self.config.getboolean("Options", "BackupExistingCollection", fallback=True):
+                    Utils.make_backup_of(path_xml)
+                os.replace(tmp_path, path_xml)
+                if archive_path is not None:
+                    os.replace(archive_path + ".tmp", archive_path)
+                    logging.info(f"Archived output to: {archive_path}")
+                self._save_fingerprints(path_xml)
+                if self._use_index():
+                    # Index our own output, so that the next run can skip the scan.
+                    CollectionIndex.load_or_build(path_xml)
+        finally:
+            for p in [tmp_path] + ([archive_path + ".tmp"] if archive_path is not None else []):
+                if os.path.exists(p):
+                    os.remove(p)
+        self._report("Writing output", 1, 1)
+
         if wrok:
             logging.info("Wrote output to file: {}".format(path_xml))
         else:
             logging.error("Failed to write to location: {}".format(path_xml))
         return wrok
 
+    def _get_archive_path(self, path_xml : str):
+        """
+        Path of the compressed archival copy of the output (ArchiveOutput = gz/bz2/xz), or None.
+        Never an existing archive's: runs within the same second get a numbered suffix.
+        """
+        fmt = self.config.get("Options", "ArchiveOutput", fallback="no").lower()
+        if fmt not in Utils.compressors:
+            if fmt != "no":
+                logging.warning(f"Unknown ArchiveOutput format '{fmt}', not archiving.")
+            return None
+        base = f"{os.path.splitext(path_xml)[0]}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        path, n = f"{base}.nml.{fmt}", 1
+        while os.path.exists(path) or os.path.exists(path + ".tmp"):
+            n += 1
+            path = f"{base}_{n}.nml.{fmt}"
+        return path
+
+    @contextlib.contextmanager
+    def _open_output(self, tmp_path : str, archive_path : str = None):
+        """
+        Opens the temporary output file; with an archive path, everything written to it is
+        also compressed into '<archive_path>.tmp' in the same pass.
+        """
+        with open(tmp_path, 'wb') as out:
+            if archive_path is None:
+                yield out
+                return
+            fmt = archive_path.rsplit(".", 1)[-1]
+            with Utils.compressors[fmt](archive_path + ".tmp", 'wb') as archive:
+                yield TeeWriter(out, archive)
+
+    def _use_index(self) -> bool:
+        return self.config.getboolean("Library", "CollectionIndex", fallback=False) \
+            and self.config.getboolean("Library", "MergeOutput", fallback=True)
+
+    def _load_index(self, path_xml : str):
+        """
+        @return (CollectionIndex, PLAYLISTS element) of the existing collection if the index is
+                enabled and usable, (None, None) otherwise.
+        """
+        if not self._use_index() or not os.path.exists(path_xml):
+            return None, None
+
+        index = CollectionIndex.load_or_build(path_xml)
+        if index is None:
+            return None, None
+        self.metrics.add("collection_index_hits" if index.from_cache else "collection_index_misses")
+        if index.playlists is None:
+            return None, None
+        start, end = index.playlists
+        try:
+            with open(path_xml, 'rb') as f:
+                f.seek(start)
+                return index, self.xml.fromstring(f.read(end - start))
+        except Exception as e:
+            logging.warning(f"Collection index is unusable, ignoring it: {e}")
+            return None, None
+
+    def _scan_collection(self, path_xml : str):
+        """
+        First pass of a streaming merge: collects FILE and LOCK of every COLLECTION ENTRY,
+        discarding each entry as soon as it's read, and keeps the (comparably small) PLAYLISTS.
+        Served from the collection index instead, when it's enabled.
+        @return (filenames, locks, (VOLUME, DIR, FILE) locations, playlists element or None),
+                or None if the file isn't valid XML.
+        """
+        index, playlists_e = self._load_index(path_xml)
+        if index is not None:
+            return [e.file for e in index.entries], [e.lock for e in index.entries], \
+                   [(e.volume, e.dir, e.file) for e in index.entries], playlists_e
+
+        logging.debug("Scanning preexisting output file: {}".format(path_xml))
+        filenames, locks, locations = [], [], []
+        playlists_e = None
+        stack = []
+        try:
+            for event, elem in self.xml.iterparse(path_xml):
+                if event == "start":
+                    stack.append(elem)
+                    continue
+                stack.pop()
+                if len(stack) == 2 and stack[1].tag == "COLLECTION" and elem.tag == "ENTRY":
+                    self._checkpoint()
+                    filenames.append(self._get_entry_file(elem))
+                    locks.append(elem.attrib.get('LOCK'))
+                    locations.append(self._get_entry_location(elem))
+                    stack[1].remove(elem)
+                elif len(stack) == 1:
+                    if elem.tag == "PLAYLISTS":
+                        playlists_e = elem
+                    stack[0].remove(elem)
+        except Cancelled:
+            raise
+        except Exception as e:
+            logging.warning(f"Existing output file isn't valid XML': {e}")
+            return None
+        return filenames, locks, locations, playlists_e
+
+    def _stream_merge(self, lib : Library, path_xml : str, out, scan : tuple) -> bool:
+        """
+        Second pass of a streaming merge: rewrites the existing collection element by element,
+        patching matched ENTRYs, appending new ones and replacing the PLAYLISTS, without ever
+        holding the whole collection in memory.
+        """
+        filenames, locks, locations, playlists_e = scan
+        matched, added = self._match_tracks(filenames, lib.track_dict)
+
+        # PLAYLISTS is small compared to the COLLECTION: render it up-front, on its own.
+        self._report("Rendering playlists", 0, 1)
+        playl_root = self.xml.Element("NML")
+        if playlists_e is not None:
+            playl_root.append(playlists_e)
+        else:
+            self.xml.SubElement(playl_root, "PLAYLISTS")
+        playlists_e = self._render_playlists(playl_root, lib).find("PLAYLISTS")
+        orphans = self._find_orphans(locations, locks, matched, self._get_referenced_keys(playlists_e)) \
+            if self._use_compaction() else set()
+
+        def write_added(out):
+            for k in self._iter_progress("Adding tracks", added):
+                t = lib.track_dict[k]
+                out.write(self.xml.tostring(self._render_track(self.xml.Element("ENTRY"), t, False), 2))
+                logging.info(f"Added '{t.name}' by '{t.artist}' to collection.")
+                self.metrics.add("tracks_added")
+
+        n_entries = str(len(filenames) - len(orphans) + len(added))
+        wrote = set()
+        stack = []
+        i = 0
+        out.write(b"<?xml version='1.0' encoding='utf-8'?>\n")
+        with open(path_xml, 'rb') as f:
+            for event, elem in self.xml.iterparse(f):
+                if event == "start":
+                    stack.append(elem)
+                    if len(stack) == 1:
+                        out.write(self.xml.start_tag(elem.tag, elem.attrib))
+                    elif len(stack) == 2 and elem.tag == "COLLECTION":
+                        out.write(self.xml.start_tag(elem.tag, {**elem.attrib, "ENTRIES": n_entries}, 1))
+                    continue
+
+                stack.pop()
+                if len(stack) == 2 and stack[1].tag == "COLLECTION" and elem.tag == "ENTRY":
+                    self._checkpoint()
+                    if i >= len(filenames) or self._get_entry_file(elem) != filenames[i]:
+                        raise CollectionOutOfSync(f"Collection changed while merging, or its index is out of sync: {path_xml}")
+                    if i % max(1, len(filenames) // 100) == 0:
+                        self._report("Merging tracks", i, len(filenames))
+                    if i in orphans:
+                        self._log_orphan(elem, locations[i])
+                    else:
+                        self._merge_entry(elem, matched[i], locks[i], lib.track_dict)
+                        out.write(self.xml.tostring(elem, 2))
+                    stack[1].remove(elem)
+                    i += 1
+                elif len(stack) == 1:
+                    if elem.tag == "COLLECTION":
+                        write_added(out)
+                        out.write(b"  </COLLECTION>\n")
+                    elif elem.tag == "PLAYLISTS":
+                        out.write(self.xml.tostring(playlists_e, 1))
+                    else:
+                        out.write(self.xml.tostring(elem, 1))
+                    wrote.add(elem.tag)
+                    stack[0].remove(elem)
+                elif len(stack) == 0:
+                    if "COLLECTION" not in wrote:
+                        out.write(self.xml.start_tag("COLLECTION", {"ENTRIES": n_entries}, 1))
+                        write_added(out)
+                        out.write(b"  </COLLECTION>\n")
+                    if "PLAYLISTS" not in wrote:
+                        out.write(self.xml.tostring(playlists_e, 1))
+                    out.write(f"</{elem.tag}>\n".encode('utf-8'))
+        return True
+
+    def plan(self, lib : Library, path_xml : str) -> dict:
+        """
+        Dry run: computes what write() would change in the collection at path_xml,
+        without rendering or serializing anything.
+        @return JSON-serializable change plan.
+        """
+        index, playlists_e = self._load_index(path_xml)
+        if index is not None:
+            # Only the PLAYLISTS and the ENTRYs to be updated are parsed, straight from their byte ranges.
+            root = self.xml.Element("NML")
+            root.append(playlists_e)
+            filenames = [e.file for e in index.entries]
+            locks = [e.lock for e in index.entries]
+            locations = [(e.volume, e.dir, e.file) for e in index.entries]
+            f = open(path_xml, 'rb')
+
+            def get_entry(i):
+                f.seek(index.entries[i].offset)
+                return self.xml.fromstring(f.read(index.entries[i].length))
+        else:
+            root = self._init_dom(path_xml)
+            entries = root.find('COLLECTION').findall('ENTRY')
+            filenames = [self._get_entry_file(t_e) for t_e in entries]
+            locks = [t_e.attrib.get('LOCK') for t_e in entries]
+            locations = [self._get_entry_location(t_e) for t_e in entries]
+            f = None
+            get_entry = lambda i: entries[i]
+        matched, added = self._match_tracks(filenames, lib.track_dict)
+
+        def describe(t : Track) -> dict:
+            return {"id": t.id, "title": t.name, "artist": t.artist, "location": t.fileurl}
+
+        plan = {"output": path_xml, "added": [], "updated": [], "locked": [], "removed": []}
+        try:
+            for i in self._iter_progress("Planning tracks", range(len(matched))):
+                if len(matched[i]) > 0 and locks[i] != "1":
+                    t_e = get_entry(i)
+                for k in matched[i]:
+                    t = lib.track_dict[k]
+                    if locks[i] == "1":
+                        plan["locked"].append(describe(t))
+                    else:
+                        plan["updated"].append({**describe(t), **self._diff_cues(t_e, t)})
+
+            plan["playlists"] = self._diff_playlists(root, lib)
+            if self._use_compaction():
+                # Orphans depend on the playlists as they'll be after writing.
+                referenced = self._plan_referenced_keys(root, lib)
+                for i in sorted(self._find_orphans(locations, locks, matched, referenced)):
+                    t_e = get_entry(i)
+                    plan["removed"].append({"title": t_e.attrib.get('TITLE', ""), "artist": t_e.attrib.get('ARTIST', ""),
+                                            "location": "".join(locations[i])})
+        finally:
+            if f is not None:
+                f.close()
+
+        for k in added:
+            t = lib.track_dict[k]
+            plan["added"].append({**describe(t), "cues": len(t.cues), "grids": len(t.grids)})
+        return plan
+
+    def _diff_cues(self, t_e, t : Track) -> dict:
+        """
+        Compares the CUE_V2 elements of an existing ENTRY with the ones a Track would render to.
+        """
+        def cue_key(attrib : dict, bpm=None) -> tuple:
+            return (attrib.get("NAME", ""), int(attrib.get("TYPE", 0)), int(attrib.get("HOTCUE", -1)),
+                    round(float(attrib.get("START", 0.0)), 1), round(float(attrib.get("LEN", 0.0)), 1), bpm)
+
+        old = set()
+        for e in t_e.findall("CUE_V2"):
+            grid = e.find("GRID")
+            old.add(cue_key(e.attrib, round(float(grid.attrib.get("BPM", 0.0)), 3) if grid is not None else None))
+
+        new = set(cue_key(self._generate_cue(c)) for c in t.cues)
+        new |= set(cue_key(self._generate_grid_marker(g), round(g.bpm, 3)) for g in t.grids)
+
+        def as_dicts(keys):
+            return [{"name": k[0], "type": k[1], "hotcue": k[2], "start": k[3], "len": k[4], "bpm": k[5]}
+                    for k in sorted(keys, key=lambda k: k[3])]
+
+        is_grid = lambda k: k[1] == Cue.Type.Grid.value
+        return {"cues_added":    as_dicts(k for k in new - old if not is_grid(k)),
+                "cues_removed":  as_dicts(k for k in old - new if not is_grid(k)),
+                "grids_added":   as_dicts(k for k in new - old if is_grid(k)),
+                "grids_removed": as_dicts(k for k in old - new if is_grid(k))}
+
+    def _diff_playlists(self, root, lib : Library) -> dict:
+        """
+        Compares the playlists under the parent playlist folder with the ones that would be rendered.
+        Paths (Playlist.child_keys() of each level) map to None for folders, and to the list of
+        PRIMARYKEY keys for playlists.
+        """
+        old = {}
+        rb_playlist_name = self._get_parent_folder_name()
+        for node in self.xml.findall(root, "PLAYLISTS/NODE/SUBNODES/NODE"):
+            if node.attrib.get("TYPE") == "FOLDER" and node.attrib.get("NAME") == rb_playlist_name:
+                stack = [(node, ())]
+                while stack:
+                    n, path = stack.pop()
+                    children = self.xml.findall(n, "SUBNODES/NODE")
+                    keys = Playlist.child_keys([c.attrib.get("NAME", "") for c in children])
+                    for c, key in zip(children, keys):
+                        if c.attrib.get("TYPE") == "FOLDER":
+                            old[path + (key,)] = None
+                            stack.append((c, path + (key,)))
+                        else:
+                            old[path + (key,)] = [e.attrib.get("KEY") for e in self.xml.findall(c, "PLAYLIST/ENTRY/PRIMARYKEY")]
+                break
+
+        new = {}
+        if lib.playl_selection is None:
+            stack = [(lib.playl_tree, ())] if lib.playl_tree is not None else []
+        else:
+            # Partial export: only the selected subtrees (and their ancestors) are rendered,
+            # playlists outside of them are left untouched.
+            stack = []
+            for path, playl in lib.playl_selection.items():
+                for i in range(1, len(path)):
+                    new[path[:i]] = None
+                stack.append((playl, path))
+            selected = lambda path: any(path[:len(s)] == s or s[:len(path)] == path for s in lib.playl_selection)
+            old = {path: v for path, v in old.items() if selected(path)}
+        while stack:
+            p, path = stack.pop()
+            if p.type == Playlist.Type.Folder:
+                if path != ():
+                    new[path] = None
+                keys = Playlist.child_keys([c.name for c in p.children])
+                stack.extend((c, path + (k,)) for c, k in zip(p.children, keys))
+            else:
+                keys = [self._generate_playl_track(k, lib.track_dict) for k in p.children]
+                new[path] = [k["KEY"] for k in keys if k is not None]
+
+        def display(path):
+            names = []
+            for key in path:
+                name, _, n = key.partition(Playlist.DUP_SEP)
+                names.append(name if n == "" else f"{name} ({int(n) + 1})")
+            return "/".join(names)
+
+        changes = {"added": [], "removed": [], "changed": []}
+        for path in sorted(set(old) | set(new)):
+            name = display(path)
+            if path not in old:
+                changes["added"].append({"path": name, "tracks": len(new[path]) if new[path] is not None else None})
+            elif path not in new:
+                changes["removed"].append({"path": name})
+            elif old[path] != new[path] and new[path] is not None and old[path] is not None:
+                changes["changed"].append({"path": name,
+                                           "tracks_added": len(set(new[path]) - set(old[path])),
+                                           "tracks_removed": len(set(old[path]) - set(new[path])),
+                                           "reordered": sorted(old[path]) == sorted(new[path])})
+            elif (old[path] is None) != (new[path] is None):
+                changes["removed"].append({"path": name})
+                changes["added"].append({"path": name, "tracks": len(new[path]) if new[path] is not None else None})
+        return changes
+
+    @staticmethod
+    def format_plan(plan : dict) -> str:
+        """
+        Human readable summary of a plan() result.
+        """
+        changed = [t for t in plan["updated"] if any(len(t[k]) > 0 for k in
+                   ["cues_added", "cues_removed", "grids_added", "grids_removed"])]
+        lines = ["Dry run, nothing written to: {}".format(plan["output"]),
+                 "Tracks: {} added, {} updated ({} with cue/grid changes), {} locked (skipped)."
+                 .format(len(plan["added"]), len(plan["updated"]), len(changed), len(plan["locked"]))]
+
+        for t in plan["added"]:
+            lines.append(f"  + '{t['title']}' by '{t['artist']}' ({t['cues']} cue(s), {t['grids']} grid(s))")
+        for t in changed:
+            delta = "cues +{}/-{}, grids +{}/-{}".format(len(t["cues_added"]), len(t["cues_removed"]),
+                                                        len(t["grids_added"]), len(t["grids_removed"]))
+            lines.append(f"  ~ '{t['title']}' by '{t['artist']}': {delta}")
+        for t in plan["locked"]:
+            lines.append(f"  = '{t['title']}' by '{t['artist']}' (locked)")
+        if len(plan["removed"]) > 0:
+            lines.append("Orphaned entries: {} removed.".format(len(plan["removed"])))
+        for t in plan["removed"]:
+            lines.append(f"  - '{t['title']}' by '{t['artist']}' ({t['location']})")
+
+        p = plan["playlists"]
+        lines.append("Playlists: {} added, {} removed, {} changed."
+                     .format(len(p["added"]), len(p["removed"]), len(p["changed"])))
+        for c in p["added"]:
+            lines.append("  + {}".format(c["path"]) + (f" ({c['tracks']} tracks)" if c["tracks"] is not None else ""))
+        for c in p["removed"]:
+            lines.append("  - {}".format(c["path"]))
+        for c in p["changed"]:
+            lines.append("  ~ {}: +{}/-{} tracks".format(c["path"], c["tracks_added"], c["tracks_removed"])
+                         + (" (reordered)" if c["reordered"] else ""))
+        return "\n".join(lines)
+
     def _init_dom(self, path_xml : str):
         root = None
         
@@ -301,15 +1467,14 @@ class TraktorWriter:
             and os.path.exists(path_xml):
             logging.debug("Reading preexisting output file: {}".format(path_xml))
             try:
-                tree = ET.parse(path_xml)
-                root = tree.getroot()
+                root = self.xml.parse(path_xml)
             except Exception as e:
                 logging.warning(f"Existing output file isn't valid XML': {e}")
 
         if root is None:
-            root = ET.Element("NML", {"VERSION": "19"})
+            root = self.xml.Element("NML", {"VERSION": "19"})
             for e in ["MUSICNODES", "COLLECTION", "PLAYLISTS", "SETS"]:
-                ET.SubElement(root, e)
+                self.xml.SubElement(root, e)
                 
         return root
     
@@ -328,7 +1493,13 @@ class TraktorWriter:
         """
         Generates attribute dictionary for a LOCATION element from a file URL.
         {"DIR": ..., "FILE", ..., "VOLUME": ...}
+        Cached per URL (a track's location is needed for its ENTRY and every playlist it's in),
+        so the returned dictionary must not be modified.
         """
+        locdict = self.__locations.get(fileurl)
+        if locdict is not None:
+            return locdict
+
         path = Utils.url2path(fileurl)
         tokens = path.split(os.sep)
         locdict = {}
@@ -336,11 +1507,17 @@ class TraktorWriter:
         if sys.platform == "darwin":            
             locdict["VOLUME"] = self._get_path_volume(path)
         else:
-            locdict["VOLUME"] = tokens.pop(1) if len(tokens) > 1 else "" 
+            locdict["VOLUME"] = sys.intern(tokens.pop(1)) if len(tokens) > 1 else ""
 
         locdict["VOLUMEID"] = ""
         locdict["FILE"] = tokens.pop(-1) if len(tokens) > 0 else ""
-        locdict["DIR"] = self.__sep.join(tokens) + self.__sep
+        # Tracks in the same folder share a single DIR string.
+        dir_tokens = tuple(tokens)
+        locdict["DIR"] = self.__dirs.get(dir_tokens)
+        if locdict["DIR"] is None:
+            locdict["DIR"] = self.__dirs[dir_tokens] = self.__sep.join(tokens) + self.__sep
+
+        self.__locations[fileurl] = locdict
         return locdict
 
     def _generate_cue(self, cue : Cue) -> dict:
@@ -362,11 +1539,11 @@ class TraktorWriter:
         cuedict = {}
         cuedict["NAME"] = name
         cuedict["DISPL_ORDER"] = "0"
-        cuedict["TYPE"] = str(Cue.Type.Loop.value if is_loop else cue.type.value)
+        cuedict["TYPE"] = self.__cue_types[Cue.Type.Loop if is_loop else cue.type]
         cuedict["START"] = str(cue.start*1000.0)
-        cuedict["LEN"] = str(cue.len*1000.0)
+        cuedict["LEN"] = self.__zero_len if cue.len == 0.0 else str(cue.len*1000.0)
         cuedict["REPEATS"] = "-1"
-        cuedict["HOTCUE"] = str(cue.num)
+        cuedict["HOTCUE"] = self.__hotcues.get(cue.num) or str(cue.num)
         return cuedict
     
     def _generate_grid_marker(self, marker : GridMarker) -> dict:
@@ -383,17 +1560,28 @@ class TraktorWriter:
         cuedict = self._generate_cue(c)
         return cuedict
     
-    @staticmethod
-    def _get_child(parent, tag : str, attrib : dict = {}):
+    def _get_child(self, parent, tag : str, attrib : dict = {}):
         """
         Retrieves or creates a child af a given tag under a certain parent. 
         """
         node = parent.find(tag)
-        return node if node is not None else ET.SubElement(parent, tag, attrib)
+        return node if node is not None else self.xml.SubElement(parent, tag, attrib)
     
-    def _generate_info(self, track : Track) -> dict:
+    def _generate_audio_info(self, track : Track) -> dict:
+        """
+        Generates the INFO attributes that describe the audio file (bitrate in bits/s, duration);
+        unknown values are left out.
+        """
         infodict = {}
-        infodict["BITRATE"] = "320" # TODO
+        if track.bitrate > 0:
+            infodict["BITRATE"] = str(track.bitrate)
+        if track.playtime > 0.0:
+            infodict["PLAYTIME"] = str(int(round(track.playtime)))
+            infodict["PLAYTIME_FLOAT"] = "{:.6f}".format(track.playtime)
+        return infodict
+
+    def _generate_info(self, track : Track) -> dict:
+        infodict = self._generate_audio_info(track)
         infodict["KEY"] = track.tonality 
         infodict["IMPORT_DATE"] = track.indate.replace('-', '/') # 2024-10-31 -> 2024/10/31
         infodict["RANKING"] = track.rating
@@ -402,55 +1590,252 @@ class TraktorWriter:
         infodict["GENRE"] = track.genre
         return infodict
 
+    def _render_track(self, t_e, t : Track, lock=True):
+        t_e.attrib['TITLE'] = t.name
+        t_e.attrib['ARTIST'] = t.artist
+        t_e.attrib['LOCK'] = "1" if lock else "0"
+
+        # self._get_child(t_e, "LOCATION", self._generate_location(t.fileurl))
+        # TODO: update BPM if overwriting track.
+        self._get_child(t_e, "ALBUM", {"TITLE": t.album})
+        info_e = t_e.find("INFO")
+        if info_e is None:
+            self.xml.SubElement(t_e, "INFO", self._generate_info(t))
+        else:
+            # Existing entries keep their INFO, but the audio file's properties are kept in sync:
+            info_e.attrib.update(self._generate_audio_info(t))
+        self._get_child(t_e, "MODIFICATION_INFO", {"AUTHOR_TYPE": "user"})
+        self._get_child(t_e, "TEMPO", {"BPM_QUALITY": "100", "BPM": str(t.bpm)})
+
+        # Always overwrite location to ensure we're synced: 
+        location_e = self._get_child(t_e, "LOCATION")
+        locdict = self._generate_location(t.fileurl)
+        old = location_e.attrib
+        if "DIR" in old and CollectionIndex.make_key(old.get("VOLUME", ""), old["DIR"], old.get("FILE", "")) \
+                != CollectionIndex.make_key(locdict["VOLUME"], locdict["DIR"], locdict["FILE"]):
+            self.metrics.add("tracks_moved")
+        self.xml.set_attrib(location_e, locdict)
+
+        for e in t_e.findall("CUE_V2"):
+            t_e.remove(e)
+        for c in t.cues:
+            self.xml.SubElement(t_e, "CUE_V2", self._generate_cue(c))
+        for g in t.grids:
+            e = self.xml.SubElement(t_e, "CUE_V2", self._generate_grid_marker(g))
+            self.xml.SubElement(e, "GRID", {"BPM": str(g.bpm)})
+        return t_e  
+
+    def _merge_entry(self, t_e, tids : list, lock : str, track_dict : dict):
+        """
+        Renders the tracks matched to an existing ENTRY into it, unless Traktor has it locked.
+        """
+        if len(tids) == 0:
+            return
+        if lock == "1":
+            self.metrics.add("tracks_locked_skipped", len(tids))
+            return
+        for k in tids:
+            self._render_track(t_e, track_dict[k], False)
+        self.metrics.add("tracks_updated", len(tids))
+
+    @staticmethod
+    def _get_entry_file(t_e) -> str:
+        location = t_e.find('LOCATION')
+        return location.attrib.get('FILE', "") if location is not None else ""
+
+    @staticmethod
+    def _get_entry_location(t_e) -> tuple:
+        """ @return (VOLUME, DIR, FILE) of an ENTRY. """
+        location = t_e.find('LOCATION')
+        a = location.attrib if location is not None else {}
+        return a.get('VOLUME', ""), a.get('DIR', ""), a.get('FILE', "")
+
+    @staticmethod
+    def _match_tracks(filenames : list, track_dict : dict):
+        """
+        Matches existing collection entries to tracks by file name.
+        @param filenames    LOCATION FILE of each existing ENTRY, in collection order.
+        @param track_dict   Track dictionary.
+        @return (matched, added): the track IDs matching each entry, and the IDs of unmatched tracks.
+        """
+        by_file = {}
+        for k, t in track_dict.items():
+            basename = os.path.basename(urllib.request.url2pathname(t.fileurl))
+            by_file.setdefault(basename, []).append(k)
+
+        matched = [by_file.pop(f, []) for f in filenames]
+        matched_ids = set(k for ks in matched for k in ks)
+        added = [k for k in track_dict if k not in matched_ids]
+        return matched, added
+
     def _render_tracks(self, root, lib : Library):
-        track_dict = dict(lib.track_dict) # copy
         coll_elem = root.find('COLLECTION')
+        entries = coll_elem.findall('ENTRY')
+        matched, added = self._match_tracks([self._get_entry_file(t_e) for t_e in entries], lib.track_dict)
         
-        def _render_track(t_e, t, lock=True):
-            t_e.attrib['TITLE'] = t.name
-            t_e.attrib['ARTIST'] = t.artist
-            t_e.attrib['LOCK'] = "1" if lock else "0"
-
-            # self._get_child(t_e, "LOCATION", self._generate_location(t.fileurl))
-            # TODO: update BPM if overwriting track.
-            self._get_child(t_e, "ALBUM", {"TITLE": t.album})
-            self._get_child(t_e, "INFO", self._generate_info(t))
-            self._get_child(t_e, "MODIFICATION_INFO", {"AUTHOR_TYPE": "user"})
-            self._get_child(t_e, "TEMPO", {"BPM_QUALITY": "100", "BPM": str(t.bpm)})
-
-            # Always overwrite location to ensure we're synced: 
-            self._get_child(t_e, "LOCATION").attrib = self._generate_location(t.fileurl)
-
-            for e in t_e.findall("CUE_V2"):
-                t_e.remove(e)
-            for c in t.cues:
-                ET.SubElement(t_e, "CUE_V2", self._generate_cue(c))
-            for g in t.grids:
-                e = ET.SubElement(t_e, "CUE_V2", self._generate_grid_marker(g))
-                ET.SubElement(e, "GRID", {"BPM": str(g.bpm)})
-            return t_e  
-        
-        for t_e in coll_elem.findall('ENTRY'):
-            lock = t_e.attrib.get('LOCK')
-            location = t_e.find('LOCATION')
-            filename = location.attrib.get('FILE') if location is not None else ""
-
-            for k in list(track_dict.keys()):
-                t = track_dict[k]
-                basename = os.path.basename(urllib.request.url2pathname(t.fileurl))
-                if basename == filename:
-                    if lock != "1":
-                        _render_track(t_e, t, False)
-                    del track_dict[k]
+        for t_e, tids in self._iter_progress("Merging tracks", list(zip(entries, matched))):
+            self._merge_entry(t_e, tids, t_e.attrib.get('LOCK'), lib.track_dict)
             
-        for uuid, t in track_dict.items():
-            t_e = ET.SubElement(coll_elem, "ENTRY")
-            _render_track(t_e, t, False)
+        for k in self._iter_progress("Adding tracks", added):
+            t = lib.track_dict[k]
+            t_e = self.xml.SubElement(coll_elem, "ENTRY")
+            self._render_track(t_e, t, False)
             logging.info(f"Added '{t.name}' by '{t.artist}' to collection.")
+            self.metrics.add("tracks_added")
             
         coll_elem.attrib["ENTRIES"] = str(len(coll_elem))
         return root
 
+    def _use_compaction(self) -> bool:
+        return self.config.getboolean("Library", "CompactCollection", fallback=False)
+
+    def _compact_collection(self, root, lib : Library):
+        """
+        Removes orphaned entries from the collection; see _find_orphans().
+        Expects the tracks and playlists to be rendered already.
+        """
+        coll_elem = root.find('COLLECTION')
+        entries = coll_elem.findall('ENTRY')
+        locations = [self._get_entry_location(t_e) for t_e in entries]
+        matched, _ = self._match_tracks([loc[2] for loc in locations], lib.track_dict)
+
+        orphans = self._find_orphans(locations, [t_e.attrib.get('LOCK') for t_e in entries], matched,
+                                     self._get_referenced_keys(root.find('PLAYLISTS')))
+        for i in sorted(orphans):
+            self._log_orphan(entries[i], locations[i])
+            coll_elem.remove(entries[i])
+
+        coll_elem.attrib["ENTRIES"] = str(len(coll_elem))
+        return root
+
+    @staticmethod
+    def _get_referenced_keys(playlists_e) -> set:
+        """ @return Normalized keys of all tracks in the playlists under a PLAYLISTS element. """
+        referenced = set()
+        if playlists_e is not None:
+            for key_e in playlists_e.iter("PRIMARYKEY"):
+                if key_e.attrib.get("TYPE") == "TRACK":
+                    referenced.add(unicodedata.normalize("NFC", key_e.attrib.get("KEY", "")))
+        return referenced
+
+    def _plan_referenced_keys(self, root, lib : Library) -> set:
+        """
+        Dry run counterpart of _get_referenced_keys() on the rendered output: keys of the tracks in
+        the playlists that will be kept as they are, plus the ones in the exported playlists.
+        """
+        playlists_e = root.find('PLAYLISTS')
+        replaced = []
+        if playlists_e is not None and lib.playl_tree is not None:
+            rb_playlist_name = self._get_parent_folder_name()
+            for node in self.xml.findall(root, "PLAYLISTS/NODE/SUBNODES/NODE"):
+                if node.attrib.get("TYPE") == "FOLDER" and node.attrib.get("NAME") == rb_playlist_name:
+                    if lib.playl_selection is None:
+                        replaced.append(node)
+                    for path in lib.playl_selection or []:
+                        node_e = node
+                        for key in path:
+                            subnodes_e = node_e.find("SUBNODES") if node_e is not None else None
+                            node_e = self._find_child_node(subnodes_e, key) if subnodes_e is not None else None
+                        if node_e is not None:
+                            replaced.append(node_e)
+                    break
+
+        referenced = set()
+        stack = [playlists_e] if playlists_e is not None else []
+        while stack:
+            e = stack.pop()
+            if any(e is r for r in replaced):
+                continue
+            if e.tag == "PRIMARYKEY" and e.attrib.get("TYPE") == "TRACK":
+                referenced.add(unicodedata.normalize("NFC", e.attrib.get("KEY", "")))
+            stack.extend(e)
+
+        stack = [lib.playl_tree] if lib.playl_tree is not None else []
+        while stack:
+            p = stack.pop()
+            if p.type == Playlist.Type.Folder:
+                stack.extend(p.children)
+                continue
+            for k in p.children:
+                attrib = self._generate_playl_track(k, lib.track_dict)
+                if attrib is not None:
+                    referenced.add(unicodedata.normalize("NFC", attrib["KEY"]))
+        return referenced
+
+    def _find_orphans(self, locations : list, locks : list, matched : list, referenced : set) -> set:
+        """
+        Finds the collection entries that nothing refers to anymore: not matched by any exported track,
+        not in any playlist, and whose file is gone. Locked entries are kept, unless CompactLockedEntries = remove.
+        @param locations    (VOLUME, DIR, FILE) of each ENTRY.
+        @param locks        LOCK of each ENTRY.
+        @param matched      Matched track IDs of each ENTRY, as from _match_tracks().
+        @param referenced   Keys of the tracks in playlists after rendering, see _get_referenced_keys().
+        @return Indices of the orphaned entries.
+        """
+        remove_locked = self.config.get("Library", "CompactLockedEntries", fallback="keep") == "remove"
+
+        orphans = set()
+        for i in self._iter_progress("Finding orphaned entries", range(len(locations))):
+            volume, dir, file = locations[i]
+            if len(matched[i]) > 0 or file == "" or (locks[i] == "1" and not remove_locked):
+                continue
+            if CollectionIndex.make_key(volume, dir, file) in referenced:
+                continue
+            if self._is_file_missing(volume, dir, file):
+                orphans.add(i)
+        return orphans
+
+    def _is_file_missing(self, volume : str, dir : str, file : str) -> bool:
+        """
+        Inverse of _generate_location(). Also understands locations written by Traktor itself
+        (DIR relative to VOLUME). Files on volumes that aren't mounted are never reported missing.
+        """
+        tokens = dir.split(self.__sep)
+        if len(tokens) > 0 and tokens[-1] == "":
+            tokens.pop()
+
+        candidates = []
+        if sys.platform == "darwin":
+            rel = os.sep.join(tokens[1:] + [file])
+            if volume == self._get_path_volume("/"):
+                candidates.append(os.sep + rel)
+            else:
+                candidates.append(os.path.join("/Volumes", volume, rel))
+        else:
+            # As written by _generate_location(): VOLUME is the first directory of the path.
+            candidates.append(os.sep.join(tokens[:1] + [volume] + tokens[1:] + [file]))
+            if os.path.isabs(volume + os.sep):
+                candidates.append(os.path.join(volume + os.sep, *tokens[1:], file))
+
+        if any(os.path.exists(path) for path in candidates):
+            return False
+        return any(self._is_volume_available(path) for path in candidates)
+
+    @staticmethod
+    def _is_volume_available(path : str) -> bool:
+        """
+        Whether the volume a path is on is there. Removable volumes are recognized by where they're
+        usually mounted (/Volumes/<name>, /media/<user>/<name>, /run/media/<user>/<name>, /mnt/<name>),
+        and must be mounted, not merely have an (empty) mount point. For any other path, its top-level
+        directory must exist.
+        """
+        drive, rest = os.path.splitdrive(path)
+        parts = rest.split(os.sep)
+        depth = None
+        if len(parts) > 2 and parts[1] == "run" and parts[2] == "media":
+            depth = 5
+        elif len(parts) > 1:
+            depth = {"Volumes": 3, "media": 4, "mnt": 3}.get(parts[1])
+        if depth is not None:
+            root = drive + os.sep.join(parts[:depth])
+            return len(parts) > depth and os.path.isdir(root) and os.path.ismount(root)
+        return len(parts) > 2 and os.path.isdir(drive + os.sep.join(parts[:2]))
+
+    def _log_orphan(self, t_e, location : tuple):
+        logging.info("Removed orphaned entry '{}' by '{}' ({}).".format(
+            t_e.attrib.get('TITLE', ""), t_e.attrib.get('ARTIST', ""), "".join(location)))
+        self.metrics.add("entries_removed")
+
     def _generate_playl_track(self, track_id : str, track_dict : dict) -> dict:
         """
         Generates attribute dictionary for a PRIMARYKEY ENTRY of a PLAYLIST NODE.
@@ -465,75 +1850,773 @@ class TraktorWriter:
         else:
             return None
 
-    def _generate_node_recursive(self, parent, playl : Playlist, track_dict : dict):
+    def _generate_tree(self, parent, playl : Playlist, track_dict : dict):
         """
+        Renders a Playlist tree depth-first, with an explicit stack.
         @param parent       Parent DOM node.
-        @param playl        Current Playlist node.
+        @param playl        Top Playlist node.
         @param track_dict   Track dictionary to render track info.
-        @return Modified parent DOM
+        @return DOM node of the top Playlist node
         """        
-        node = parent if playl.name == "ROOT" else ET.SubElement(parent, "NODE", {"NAME": playl.name})
-
-        if playl.type == Playlist.Type.Folder:
-            node.attrib["TYPE"] = "FOLDER"
-            subnode = ET.SubElement(node, "SUBNODES", {"COUNT": str(len(playl.children))})
-            for c in playl.children:
-                self._generate_node_recursive(subnode, c, track_dict)
-        elif playl.type == Playlist.Type.List:
-            node.attrib["TYPE"] = "PLAYLIST"
-            playlist = ET.SubElement(node, "PLAYLIST",
-                                     {"ENTRIES": str(len(playl.children)),
-                                      "TYPE": "LIST",
-                                      "UUID": "/db/Playlist/" + str(uuid.uuid4())})
-            for c in playl.children:
-                playl_track = self._generate_playl_track(c, track_dict)
-                if playl_track is not None:
-                    entry = ET.SubElement(playlist, "ENTRY")
-                    ET.SubElement(entry, "PRIMARYKEY", self._generate_playl_track(c, track_dict))
-                else: 
-                    logging.info(f"Skipping missing track ID {c} in playlist '{playl.name}'")
-
-        return node
-
-    def _render_playlists(self, root, lib : Library):
+        top = None
+        stack = [(parent, playl)]
+        while stack:
+            self._checkpoint()
+            parent, playl = stack.pop()
+            node = parent if playl.name == "ROOT" else self.xml.SubElement(parent, "NODE", {"NAME": playl.name})
+            top = node if top is None else top
+
+            if playl.type == Playlist.Type.Folder:
+                node.attrib["TYPE"] = "FOLDER"
+                subnode = self.xml.SubElement(node, "SUBNODES", {"COUNT": str(len(playl.children))})
+                stack.extend((subnode, c) for c in reversed(playl.children))
+            elif playl.type == Playlist.Type.List:
+                node.attrib["TYPE"] = "PLAYLIST"
+                playlist = self.xml.SubElement(node, "PLAYLIST",
+                                         {"ENTRIES": str(len(playl.children)),
+                                          "TYPE": "LIST",
+                                          "UUID": "/db/Playlist/" + str(uuid.uuid4())})
+                entries = []
+                for c in playl.children:
+                    playl_track = self._generate_playl_track(c, track_dict)
+                    if playl_track is not None:
+                        entry = self.xml.Element("ENTRY")
+                        self.xml.SubElement(entry, "PRIMARYKEY", playl_track)
+                        entries.append(entry)
+                    else: 
+                        logging.info(f"Skipping missing track ID {c} in playlist '{playl.name}'")
+                playlist.extend(entries)
+
+        return top
+
+    def _get_parent_folder_name(self) -> str:
         # All rekordbox playlists will be exported under this folder; manual changes to it will be overwritten.
         playl_name_fallback = "rekordbox"
         rb_playlist_name = self.config.get("Library", "ParentPlaylistFolder", fallback="")
-        rb_playlist_name = rb_playlist_name if rb_playlist_name != "" else playl_name_fallback
+        return rb_playlist_name if rb_playlist_name != "" else playl_name_fallback
+
+    def _render_playlists(self, root, lib : Library):
+        rb_playlist_name = self._get_parent_folder_name()
 
         if lib.playl_tree is not None:
             playlists_e = root.find('PLAYLISTS')
             playlroot_e = self._get_child(playlists_e, "NODE", {"NAME": "$ROOT", "TYPE": "FOLDER"})
             psubnodes_e = self._get_child(playlroot_e, "SUBNODES", {"COUNT": "1"})
             
+            incremental = self.config.getboolean("Library", "IncrementalPlaylists", fallback=False)
+            old_fps = self._load_fingerprints(rb_playlist_name) if incremental else {}
+
+            if lib.playl_selection is not None:
+                # Partial export: only replace the selected playlists, keep everything else.
+                exportsubnodes_e = self._get_folder_subnodes(psubnodes_e, rb_playlist_name)
+                for path, playl in lib.playl_selection.items():
+                    self._replace_node(exportsubnodes_e, playl, path, lib.track_dict)
+                if incremental:
+                    # Forget the replaced subtrees (and their ancestors), they'll be rebuilt next time.
+                    self._playlist_fps = {key: fp for key, fp in old_fps.items()
+                                          if not any(key[:len(p)] == p or p[:len(key)] == key
+                                                     for p in lib.playl_selection)}
+                return root
+
+            exportroot_e = None
             for node in psubnodes_e.findall("NODE"):
                 if node.attrib["TYPE"] == "FOLDER" and node.attrib["NAME"] == rb_playlist_name:
-                    psubnodes_e.remove(node)
+                    exportroot_e = node
                     break
 
-            exportroot_e = ET.SubElement(psubnodes_e, "NODE", {"NAME": rb_playlist_name, "TYPE": "FOLDER"})
+            if incremental:
+                self._playlist_fps = self._fingerprint_tree(lib.playl_tree, lib.track_dict)
+                if exportroot_e is not None and len(old_fps) > 0:
+                    self._sync_tree(exportroot_e, lib.playl_tree, lib.track_dict, old_fps, self._playlist_fps)
+                    return root
+
+            if exportroot_e is not None:
+                psubnodes_e.remove(exportroot_e)
+
+            exportroot_e = self.xml.SubElement(psubnodes_e, "NODE", {"NAME": rb_playlist_name, "TYPE": "FOLDER"})
         
-            self._generate_node_recursive(exportroot_e, lib.playl_tree, lib.track_dict)
+            self._generate_tree(exportroot_e, lib.playl_tree, lib.track_dict)
         return root
 
-    def _write_to_output(self, xml_path, root) -> bool:
-        Utils.xml_indent(root)
-        tree = ET.ElementTree(root)
-        return tree.write(xml_path, encoding='utf-8', xml_declaration=True) is None
+    def _fingerprint_tree(self, playl_root : Playlist, track_dict : dict) -> dict:
+        """
+        Fingerprints every node of a Playlist tree by name, type and ordered track keys
+        (for playlists), or by name and the fingerprints of its children (for folders).
+        @return {path (tuple of child keys): fingerprint}
+        """
+        fps = {}
+        stack = [(playl_root, (), False)]
+        while stack:
+            playl, path, visited = stack.pop()
+            h = hashlib.blake2b(digest_size=16)
+            h.update(playl.name.encode('utf-8') + b"\0")
+            if playl.type == Playlist.Type.List:
+                h.update(b"L")
+                for k in playl.children:
+                    attrib = self._generate_playl_track(k, track_dict)
+                    if attrib is not None:
+                        h.update(attrib["KEY"].encode('utf-8') + b"\0")
+                fps[path] = h.hexdigest()
+            elif not visited:
+                # Children first, then the folder itself.
+                stack.append((playl, path, True))
+                keys = Playlist.child_keys([c.name for c in playl.children])
+                stack.extend((c, path + (k,), False) for c, k in zip(playl.children, keys))
+            else:
+                h.update(b"F")
+                for k in Playlist.child_keys([c.name for c in playl.children]):
+                    h.update(fps[path + (k,)].encode('ascii'))
+                fps[path] = h.hexdigest()
+        return fps
+
+    def _sync_tree(self, exportroot_e, playl_root : Playlist, track_dict : dict, old_fps : dict, new_fps : dict):
+        """
+        Updates a previously exported playlist tree in place: subtrees whose fingerprint didn't change
+        are kept verbatim (including their UUIDs), changed folders are synced, everything else is rebuilt.
+        """
+        kept, rebuilt = 0, 0
+        stack = [(exportroot_e, playl_root, ())]
+        while stack:
+            self._checkpoint()
+            node_e, playl, path = stack.pop()
+            subnodes_e = self._get_child(node_e, "SUBNODES", {"COUNT": "0"})
+            old_nodes = subnodes_e.findall("NODE")
+            old_children = dict(zip(Playlist.child_keys([n.attrib.get("NAME", "") for n in old_nodes]), old_nodes))
+
+            children = []
+            for c, key in zip(playl.children, Playlist.child_keys([c.name for c in playl.children])):
+                cpath = path + (key,)
+                old_e = old_children.get(key)
+                is_folder = c.type == Playlist.Type.Folder
+                if old_e is not None and old_e.attrib.get("TYPE") != ("FOLDER" if is_folder else "PLAYLIST"):
+                    old_e = None
+
+                if old_e is not None and old_fps.get(cpath) == new_fps[cpath] and self._is_intact(old_e, c, track_dict):
+                    children.append(old_e)
+                    kept += 1
+                elif old_e is not None and is_folder:
+                    children.append(old_e)
+                    stack.append((old_e, c, cpath))
+                else:
+                    children.append(self._generate_tree(self.xml.Element("SUBNODES"), c, track_dict))
+                    rebuilt += 1
+
+            for n in old_nodes:
+                subnodes_e.remove(n)
+            subnodes_e.extend(children)
+            subnodes_e.attrib["COUNT"] = str(len(children))
+
+        logging.info(f"Playlists: kept {kept} unchanged subtree(s), rebuilt {rebuilt}.")
+        self.metrics.add("playlist_subtrees_kept", kept)
+        self.metrics.add("playlist_subtrees_rebuilt", rebuilt)
+
+    def _is_intact(self, node_e, playl : Playlist, track_dict : dict) -> bool:
+        """
+        Cheap sanity check of a previously exported node against manual changes in Traktor:
+        compares its number of children (folders) or entries (playlists).
+        """
+        if playl.type == Playlist.Type.Folder:
+            return len(self.xml.findall(node_e, "SUBNODES/NODE")) == len(playl.children)
+        n_entries = sum(1 for k in playl.children if k in track_dict)
+        return len(self.xml.findall(node_e, "PLAYLIST/ENTRY")) == n_entries
+
+    @staticmethod
+    def _fingerprints_path(path_xml : str) -> str:
+        return path_xml + ".rb2tk-playlists.json"
+
+    def _load_fingerprints(self, rb_playlist_name : str) -> dict:
+        path = self._fingerprints_path(self._output_path)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data["parent"] == rb_playlist_name:
+                return {tuple(k.split(self.__path_sep)) if k != "" else (): fp for k, fp in data["nodes"].items()}
+        except (OSError, ValueError, KeyError):
+            pass
+        return {}
+
+    def _save_fingerprints(self, path_xml : str):
+        if self._playlist_fps is None:
+            return
+        data = {"parent": self._get_parent_folder_name(),
+                "nodes": {self.__path_sep.join(k): fp for k, fp in self._playlist_fps.items()}}
+        try:
+            with open(self._fingerprints_path(path_xml), "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+        except OSError as e:
+            logging.warning(f"Failed to save playlist fingerprints: {e}")
+
+    def _get_folder_subnodes(self, subnodes_e, name : str):
+        """
+        Retrieves (or creates) the SUBNODES element of the folder NODE with a given name.
+        """
+        for node in subnodes_e.findall("NODE"):
+            if node.attrib.get("TYPE") == "FOLDER" and node.attrib.get("NAME") == name:
+                return self._get_child(node, "SUBNODES", {"COUNT": "0"})
+
+        node = self.xml.SubElement(subnodes_e, "NODE", {"NAME": name, "TYPE": "FOLDER"})
+        subnodes_e.attrib["COUNT"] = str(len(subnodes_e.findall("NODE")))
+        return self.xml.SubElement(node, "SUBNODES", {"COUNT": "0"})
+
+    @staticmethod
+    def _find_child_node(subnodes_e, key : str):
+        """ @return The NODE under a SUBNODES element identified by a Playlist.child_keys() key, or None. """
+        nodes = subnodes_e.findall("NODE")
+        return dict(zip(Playlist.child_keys([n.attrib.get("NAME", "") for n in nodes]), nodes)).get(key)
+
+    def _replace_node(self, subnodes_e, playl : Playlist, path : tuple, track_dict : dict):
+        """
+        Regenerates a single playlist (or folder) at the given path, creating its parent folders
+        as needed, and leaving its siblings untouched.
+        @param path     Playlist.child_keys() of each level, see Library.playl_selection.
+        """
+        for key in path[:-1]:
+            node = self._find_child_node(subnodes_e, key)
+            if node is None or node.attrib.get("TYPE") != "FOLDER":
+                node = self.xml.SubElement(subnodes_e, "NODE", {"NAME": Playlist.key_name(key), "TYPE": "FOLDER"})
+                subnodes_e.attrib["COUNT"] = str(len(subnodes_e.findall("NODE")))
+            subnodes_e = self._get_child(node, "SUBNODES", {"COUNT": "0"})
+
+        node = self._find_child_node(subnodes_e, path[-1])
+        index = len(subnodes_e)
+        if node is not None:
+            index = list(subnodes_e).index(node)
+            subnodes_e.remove(node)
+
+        tmp_e = self.xml.Element("SUBNODES")
+        subnodes_e.insert(index, self._generate_tree(tmp_e, playl, track_dict))
+        subnodes_e.attrib["COUNT"] = str(len(subnodes_e.findall("NODE")))
+
+    def _write_to_output(self, out, root) -> bool:
+        return self.xml.write(root, out)
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# AudioProbe
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+class FileCache:
+    """
+    Per-file results, cached in a JSON file and valid for as long as the file's size and mtime
+    don't change. Thread-safe; with an empty path, results are only kept in memory.
+    """
+    def __init__(self, path : str, version : int):
+        self.path = path
+        self.version = version
+        self.files = {}
+        """ {path: [size, mtime, *values]} """
+        self.__loaded = False
+        self.__dirty = False
+        self.__lock = threading.Lock()
+
+    def get(self, path : str, st : os.stat_result):
+        """ @return The cached values of a file (possibly an empty list), or None on a miss. """
+        with self.__lock:
+            cached = self.files.get(path)
+        if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2:]
+        return None
+
+    def put(self, path : str, st : os.stat_result, values : list):
+        with self.__lock:
+            self.files[path] = [st.st_size, st.st_mtime_ns] + values
+            self.__dirty = True
+
+    def load(self):
+        if self.path == "" or self.__loaded:
+            return
+        self.__loaded = True
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data["version"] == self.version:
+                self.files = data["files"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def save(self):
+        if self.path == "" or not self.__dirty:
+            return
+        try:
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"version": self.version, "files": self.files}, f, separators=(",", ":"))
+            os.replace(self.path + ".tmp", self.path)
+            self.__dirty = False
+        except OSError as e:
+            logging.warning(f"Failed to save cache {self.path}: {e}")
+
+
+class AudioProbe(Stage):
+    """
+    Reads the technical metadata (bitrate, sample rate, exact duration) of audio files straight
+    from their headers: MP3 (frame header, Xing/Info or VBRI), M4A (mdhd, esds), FLAC (STREAMINFO),
+    WAV and AIFF. Files are memory-mapped and only the bytes needed are touched; they are probed
+    in a thread pool, and the results are cached on disk by file size and mtime.
+    For M4A files, the encoder delay (priming) is read from the iTunSMPB tag or the edit list.
+    Also computes partial content hashes of files, e.g. to find duplicates.
+    """
+    CACHE_VERSION = 2
+    HASH_CACHE_VERSION = 1
+    HASH_BLOCK_SIZE = 64 * 1024
+    Info = collections.namedtuple("Info", ["bitrate", "samplerate", "duration", "delay"], defaults=[None])
+    """ bitrate in bits/s, samplerate in Hz, duration and delay in seconds (delay: None = unknown). """
+
+    __mp3_bitrates = {  # kbit/s, by (MPEG-1, layer)
+        (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+        (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+        (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+        (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+        (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+        (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    }
+    __mp3_samplerates = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+    """ Hz, by MPEG version bits (3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5). """
+
+    def __init__(self, config, progress=None, cancel=None, metrics=None):
+        super().__init__(config, progress, cancel, metrics)
+        self.cache = FileCache(self._get_cache_path(config), self.CACHE_VERSION)
+        """ Info of each file; no values for files that couldn't be probed. """
+        self.hash_cache = FileCache(config.get("Options", "HashCache", fallback=""), self.HASH_CACHE_VERSION)
+
+    def probe(self, tracks : dict) -> dict:
+        """
+        Fills in the bitrate, sample rate and exact duration of the tracks whose files can be probed.
+        @param tracks   Track dictionary.
+        @return The track dictionary.
+        """
+        paths = {tid: Utils.url2path(t.fileurl) for tid, t in tracks.items()}
+        infos = self.probe_files(sorted(set(paths.values())))
+
+        for tid, t in tracks.items():
+            info = infos.get(paths[tid])
+            if info is not None:
+                t.bitrate = info.bitrate if info.bitrate > 0 else t.bitrate
+                t.samplerate = info.samplerate if info.samplerate > 0 else t.samplerate
+                t.playtime = info.duration
+
+        logging.info(f"Probed audio info of {len(infos)} of {len(paths)} file(s).")
+        return tracks
+
+    @staticmethod
+    def _get_cache_path(config) -> str:
+        """
+        ProbeCache, by default a sidecar of the output ('<TraktorNmlOutput>.rb2tk-probe.json');
+        empty or 'no' keeps probed info in memory only.
+        """
+        path = config.get("Options", "ProbeCache", fallback=None)
+        if path is None:
+            output = config.get("Library", "TraktorNmlOutput", fallback="")
+            return output + ".rb2tk-probe.json" if output != "" else ""
+        return "" if path.lower() == "no" else path
+
+    def probe_files(self, paths : list) -> dict:
+        """
+        @return {path: Info} of the files that could be probed.
+        """
+        return self._map_files("Probing audio files", self.probe_file, paths, self.cache)
+
+    def hash_files(self, paths : list) -> dict:
+        """
+        @return {path: partial content hash} of the files that could be read.
+        """
+        return self._map_files("Hashing files", self.hash_file, paths, self.hash_cache)
+
+    def _map_files(self, stage : str, func, paths : list, cache : FileCache) -> dict:
+        """
+        Applies func to each path in a thread pool (bounded by ProbeWorkers).
+        @return {path: result} of the paths func didn't return None for.
+        """
+        cache.load()
+        workers = self.config.getint("Options", "ProbeWorkers", fallback=0)
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers if workers > 0 else None)
+        try:
+            futures = [pool.submit(func, p) for p in paths]
+            results = {}
+            for path, future in self._iter_progress(stage, list(zip(paths, futures))):
+                result = future.result()
+                if result is not None:
+                    results[path] = result
+            return results
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            cache.save()
+
+    def hash_file(self, path : str):
+        """
+        Hashes a file's size and three blocks of its content (head, middle and tail), or all of it if
+        it's small. Enough to tell copies of the same audio file apart from different files.
+        @return Hex digest, or None if the file can't be read.
+        """
+        try:
+            st = os.stat(path)
+            cached = self.hash_cache.get(path, st)
+            if cached is not None:
+                self.metrics.add("hash_cache_hits")
+                return cached[0] if len(cached) > 0 else None
+            self.metrics.add("hash_cache_misses")
+
+            h = hashlib.blake2b(st.st_size.to_bytes(8, "little"), digest_size=16)
+            with open(path, 'rb') as f:
+                if st.st_size <= 3 * self.HASH_BLOCK_SIZE:
+                    h.update(f.read())
+                else:
+                    for offset in (0, (st.st_size - self.HASH_BLOCK_SIZE) // 2, st.st_size - self.HASH_BLOCK_SIZE):
+                        f.seek(offset)
+                        h.update(f.read(self.HASH_BLOCK_SIZE))
+        except OSError as e:
+            logging.debug(f"Failed to hash '{path}': {e}")
+            return None
+
+        self.hash_cache.put(path, st, [h.hexdigest()])
+        return h.hexdigest()
+
+    def probe_file(self, path : str):
+        """
+        @return Info, or None if the file can't be read or its format isn't supported.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        cached = self.cache.get(path, st)
+        if cached is not None:
+            self.metrics.add("audio_probe_cache_hits")
+            return self.Info(*cached) if len(cached) > 0 else None
+        self.metrics.add("audio_probe_cache_misses")
+
+        info = None
+        if st.st_size > 0:
+            try:
+                with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    info = self._probe_mapped(mm)
+            except (OSError, ValueError, IndexError, struct.error) as e:
+                logging.debug(f"Failed to probe '{path}': {e}")
+
+        self.cache.put(path, st, list(info) if info is not None else [])
+        return info
+
+    def _probe_mapped(self, mm):
+        """
+        Dispatches on the file's magic bytes rather than its extension.
+        """
+        head = mm[:12]
+        if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+            return self._probe_wav(mm)
+        if head[:4] == b"FORM" and head[8:12] in (b"AIFF", b"AIFC"):
+            return self._probe_aiff(mm)
+        if head[4:8] == b"ftyp":
+            return self._probe_mp4(mm)
+
+        start = self._skip_id3(mm)
+        if mm[start:start + 4] == b"fLaC":
+            return self._probe_flac(mm, start)
+        return self._probe_mp3(mm, start)
+
+    @staticmethod
+    def _skip_id3(mm) -> int:
+        """
+        @return Offset of the first byte after the ID3v2 tag(s), if any.
+        """
+        offset = 0
+        while mm[offset:offset + 3] == b"ID3":
+            h = mm[offset:offset + 10]
+            size = (h[6] << 21) | (h[7] << 14) | (h[8] << 7) | h[9]
+            offset += 10 + size + (10 if h[5] & 0x10 else 0)
+        return offset
+
+    @staticmethod
+    def _mp3_header(mm, pos : int):
+        """
+        @return (version, layer, bitrate index, samplerate index, padding) of a valid MPEG audio frame header, or None.
+        """
+        if pos + 4 > len(mm):
+            return None
+        h = struct.unpack(">I", mm[pos:pos + 4])[0]
+        version, layer = (h >> 19) & 3, 4 - ((h >> 17) & 3)
+        br_index, sr_index = (h >> 12) & 15, (h >> 10) & 3
+        if (h >> 21) & 0x7ff != 0x7ff or version == 1 or layer == 4 or br_index in (0, 15) or sr_index == 3:
+            return None
+        return version, layer, br_index, sr_index, (h >> 9) & 1
+
+    def _probe_mp3(self, mm, start : int):
+        # Frame sync: the first valid header followed by another one (max. 64 KiB of junk skipped).
+        end = min(len(mm), start + 65536)
+        pos = mm.find(b"\xff", start, end)
+        while pos >= 0:
+            header = self._mp3_header(mm, pos)
+            if header is not None:
+                version, layer, br_index, sr_index, padding = header
+                mpeg1 = version == 3
+                samplerate = self.__mp3_samplerates[version][sr_index]
+                bitrate = self.__mp3_bitrates[(mpeg1, layer)][br_index] * 1000
+                if layer == 1:
+                    frame_len = (12 * bitrate // samplerate + padding) * 4
+                else:
+                    frame_len = (144 if mpeg1 or layer == 2 else 72) * bitrate // samplerate + padding
+                following = self._mp3_header(mm, pos + frame_len)
+                if following is not None and following[:2] == header[:2] and following[3] == sr_index:
+                    break
+            pos = mm.find(b"\xff", pos + 1, end)
+        else:
+            return None
+
+        mono = (mm[pos + 3] >> 6) & 3 == 3
+        spf = 384 if layer == 1 else (1152 if mpeg1 or layer == 2 else 576)
+
+        # VBR headers: Xing/Info after the side info, VBRI at a fixed offset.
+        frames, nbytes = 0, 0
+        xing = pos + 4 + (17 if mono else 32) if mpeg1 else pos + 4 + (9 if mono else 17)
+        if mm[xing:xing + 4] in (b"Xing", b"Info"):
+            flags = struct.unpack(">I", mm[xing + 4:xing + 8])[0]
+            if flags & 1:
+                frames = struct.unpack(">I", mm[xing + 8:xing + 12])[0]
+            if flags & 2:
+                nbytes = struct.unpack(">I", mm[xing + 8 + 4*(flags & 1):xing + 12 + 4*(flags & 1)])[0]
+        elif mm[pos + 36:pos + 40] == b"VBRI":
+            nbytes, frames = struct.unpack(">II", mm[pos + 46:pos + 54])
+
+        audio_bytes = len(mm) - pos - (128 if mm[-128:-125] == b"TAG" else 0)
+        if frames > 0:
+            duration = frames * spf / samplerate
+            bitrate = int(round((nbytes or audio_bytes) * 8 / duration)) if duration > 0 else bitrate
+        else:
+            duration = audio_bytes * 8 / bitrate
+        return self.Info(bitrate, samplerate, duration)
+
+    @staticmethod
+    def _iter_boxes(mm, start : int, end : int):
+        """
+        Iterates over the MP4 boxes (atoms) in a byte range, without reading their payloads.
+        @return Generator of (type, payload start, box end).
+        """
+        pos = start
+        while pos + 8 <= end:
+            size, btype = struct.unpack(">I4s", mm[pos:pos + 8])
+            header = 8
+            if size == 1:
+                size = struct.unpack(">Q", mm[pos + 8:pos + 16])[0]
+                header = 16
+            elif size == 0:
+                size = end - pos
+            if size < header or pos + size > end:
+                return
+            yield btype, pos + header, pos + size
+            pos += size
+
+    def _find_box(self, mm, path : list, start : int, end : int):
+        """
+        Follows a path of box types (e.g. [b"moov", b"udta"]), taking the first match at each level.
+        @return (payload start, box end), or None.
+        """
+        for btype in path:
+            for t, payload, box_end in self._iter_boxes(mm, start, end):
+                if t == btype:
+                    start, end = payload, box_end
+                    break
+            else:
+                return None
+        return start, end
+
+    def _probe_mp4(self, mm):
+        moov = self._find_box(mm, [b"moov"], 0, len(mm))
+        if moov is None:
+            return None
+
+        for btype, trak, trak_end in self._iter_boxes(mm, *moov):
+            if btype != b"trak":
+                continue
+            mdia = self._find_box(mm, [b"mdia"], trak, trak_end)
+            hdlr = self._find_box(mm, [b"hdlr"], *mdia) if mdia is not None else None
+            if hdlr is None or mm[hdlr[0] + 8:hdlr[0] + 12] != b"soun":
+                continue
+
+            mdhd = self._find_box(mm, [b"mdhd"], *mdia)
+            if mdhd is None:
+                return None
+            p = mdhd[0]
+            if mm[p] == 1:
+                timescale, duration = struct.unpack(">IQ", mm[p + 20:p + 32])
+            else:
+                timescale, duration = struct.unpack(">II", mm[p + 12:p + 20])
+            if timescale == 0:
+                return None
+
+            # First sample entry (e.g. mp4a, alac): 16.16 sample rate at +32, child boxes from +36.
+            samplerate, bitrate = timescale, 0
+            stsd = self._find_box(mm, [b"minf", b"stbl", b"stsd"], *mdia)
+            if stsd is not None and stsd[1] - stsd[0] >= 8 + 36:
+                entry = stsd[0] + 8
+                entry_end = entry + struct.unpack(">I", mm[entry:entry + 4])[0]
+                samplerate = struct.unpack(">I", mm[entry + 32:entry + 36])[0] >> 16 or timescale
+                esds = self._find_box(mm, [b"esds"], entry + 36, entry_end)
+                if esds is not None:
+                    bitrate = self._esds_bitrate(mm, esds[0] + 4, esds[1])
+
+            seconds = duration / timescale
+            if bitrate == 0 and seconds > 0:
+                mdat = self._find_box(mm, [b"mdat"], 0, len(mm))
+                bitrate = int(round((mdat[1] - mdat[0]) * 8 / seconds)) if mdat is not None else 0
+
+            delay = self._itunsmpb_delay(mm, moov)
+            if delay is not None:
+                delay = delay / samplerate
+            else:
+                delay = self._elst_delay(mm, trak, trak_end)
+                delay = delay / timescale if delay is not None else None
+            return self.Info(bitrate, samplerate, seconds, delay)
+        return None
+
+    def _itunsmpb_delay(self, mm, moov : tuple):
+        """
+        Encoder delay in samples, from the iTunes gapless info tag (moov/udta/meta/ilst/----:iTunSMPB),
+        e.g. " 00000000 00000840 000001CC 0000000000A2D834 ...": the 2nd field is the delay (0x840 = 2112).
+        """
+        meta = self._find_box(mm, [b"udta", b"meta"], *moov)
+        if meta is None:
+            return None
+        # ISO 'meta' is a full box (version & flags first); QuickTime's isn't.
+        start = meta[0] if mm[meta[0] + 4:meta[0] + 8] == b"hdlr" else meta[0] + 4
+        ilst = self._find_box(mm, [b"ilst"], start, meta[1])
+        if ilst is None:
+            return None
+
+        for btype, item, item_end in self._iter_boxes(mm, *ilst):
+            if btype != b"----":
+                continue
+            name, value = None, None
+            for t, payload, box_end in self._iter_boxes(mm, item, item_end):
+                if t == b"name":
+                    name = mm[payload + 4:box_end]
+                elif t == b"data":
+                    value = mm[payload + 8:box_end]
+            if name == b"iTunSMPB" and value is not None:
+                fields = value.split()
+                try:
+                    return int(fields[1], 16) if len(fields) > 1 else None
+                except ValueError:
+                    return None
+        return None
+
+    def _elst_delay(self, mm, trak : int, trak_end : int):
+        """
+        Encoder delay in media timescale units, from the media time of the track's first non-empty edit.
+        """
+        elst = self._find_box(mm, [b"edts", b"elst"], trak, trak_end)
+        if elst is None:
+            return None
+        p = elst[0]
+        version = mm[p]
+        count = struct.unpack(">I", mm[p + 4:p + 8])[0]
+        p += 8
+        for _ in range(count):
+            if version == 1:
+                media_time = struct.unpack(">q", mm[p + 8:p + 16])[0]
+                p += 20
+            else:
+                media_time = struct.unpack(">i", mm[p + 4:p + 8])[0]
+                p += 12
+            if media_time >= 0:
+                return media_time
+        return None
+
+    @staticmethod
+    def _esds_bitrate(mm, pos : int, end : int) -> int:
+        """
+        Average bitrate from the DecoderConfigDescriptor of an ES descriptor (ISO 14496-1).
+        """
+        def descriptor(pos):
+            tag, length = mm[pos], 0
+            pos += 1
+            for _ in range(4):
+                b = mm[pos]
+                pos += 1
+                length = (length << 7) | (b & 0x7f)
+                if not b & 0x80:
+                    break
+            return tag, pos, length
+
+        tag, pos, _ = descriptor(pos)
+        if tag != 0x03:
+            return 0
+        flags = mm[pos + 2]
+        pos += 3 + (2 if flags & 0x80 else 0)
+        pos += (1 + mm[pos] if flags & 0x40 else 0) + (2 if flags & 0x20 else 0)
+        tag, pos, _ = descriptor(pos)
+        if tag != 0x04 or pos + 13 > end:
+            return 0
+        max_bitrate, avg_bitrate = struct.unpack(">II", mm[pos + 5:pos + 13])
+        return avg_bitrate or max_bitrate
+
+    def _probe_flac(self, mm, start : int):
+        pos = start + 4
+        while pos + 4 <= len(mm):
+            header = mm[pos]
+            length = int.from_bytes(mm[pos + 1:pos + 4], "big")
+            if header & 0x7f == 0:  # STREAMINFO
+                bits = int.from_bytes(mm[pos + 14:pos + 22], "big")
+                samplerate = bits >> 44
+                samples = bits & 0xfffffffff
+                if samplerate == 0:
+                    return None
+                duration = samples / samplerate
+                bitrate = int(round((len(mm) - start) * 8 / duration)) if duration > 0 else 0
+                return self.Info(bitrate, samplerate, duration)
+            if header & 0x80:  # last metadata block
+                break
+            pos += 4 + length
+        return None
+
+    def _probe_wav(self, mm):
+        byterate, samplerate, data_size = 0, 0, 0
+        pos = 12
+        while pos + 8 <= len(mm):
+            ckid, size = struct.unpack("<4sI", mm[pos:pos + 8])
+            if ckid == b"fmt ":
+                samplerate, byterate = struct.unpack("<II", mm[pos + 12:pos + 20])
+            elif ckid == b"data":
+                data_size = min(size, len(mm) - pos - 8)
+                break
+            pos += 8 + size + (size & 1)
+        if byterate == 0:
+            return None
+        return self.Info(byterate * 8, samplerate, data_size / byterate)
+
+    def _probe_aiff(self, mm):
+        pos = 12
+        while pos + 8 <= len(mm):
+            ckid, size = struct.unpack(">4sI", mm[pos:pos + 8])
+            if ckid == b"COMM":
+                channels, frames, bits = struct.unpack(">HIH", mm[pos + 8:pos + 16])
+                # 80-bit IEEE 754 extended precision sample rate.
+                exponent, mantissa = struct.unpack(">HQ", mm[pos + 16:pos + 26])
+                samplerate = int(round(math.ldexp(mantissa, (exponent & 0x7fff) - 16383 - 63)))
+                if samplerate == 0:
+                    return None
+                return self.Info(samplerate * channels * bits, samplerate, frames / samplerate)
+            pos += 8 + size + (size & 1)
+        return None
 
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # OptionalOperations
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-class OptionalOperations:
-    def __init__(self, config):
-        self.config = config
-        pass
+class OptionalOperations(Stage):
+    def __init__(self, config, progress=None, cancel=None, metrics=None):
+        super().__init__(config, progress, cancel, metrics)
+        self.probe = AudioProbe(config, progress, cancel, self.metrics)
 
     def apply(self, lib : Library) -> Library:
         lib.track_dict = self._prune_missing_tracks(lib.track_dict)
 
-        if self.config.getboolean("Options", "SmoothenGridMarkers", fallback=True):
+        if self.config.getboolean("Options", "ProbeAudioInfo", fallback=True):
+            lib.track_dict = self.probe.probe(lib.track_dict)
+
+        if self.config.getboolean("Options", "DeduplicateTracks", fallback=False):
+            lib = self._deduplicate_tracks(lib)
+
+        if self.config.getboolean("Options", "CompactGridMarkers", fallback=False):
+            lib.track_dict = self._compact_grid_markers(lib.track_dict)
+        elif self.config.getboolean("Options", "SmoothenGridMarkers", fallback=True):
             lib.track_dict = self._prune_redundant_grid_markers(lib.track_dict)
 
         if self.config.getboolean("Options", "FixCuePositions", fallback=True):
@@ -543,9 +2626,6 @@ class OptionalOperations:
         if quantization >= 1.0/8.0: # minimum: 32nd note quantization
             lib.track_dict = self._tk_quantize_loops(lib.track_dict, quantization)
 
-        if self.config.getboolean("Options", "BackupExistingCollection", fallback=True):
-            Utils.make_backup_of(self.config["Library"]["TraktorNmlOutput"])
-
         if self.config.getboolean("Options", "S8_AutoAssignCueToPads", fallback=False):
             lib.track_dict = self._tk_s8_assign_cues_to_pads(lib.track_dict)
         
@@ -557,7 +2637,7 @@ class OptionalOperations:
         """
         pruned_ids = []
 
-        for tid in tracks:
+        for tid in self._iter_progress("Pruning missing tracks", tracks):
             t = tracks[tid]
             path = Utils.url2path(t.fileurl)
             if not os.path.isfile(path):
@@ -566,14 +2646,79 @@ class OptionalOperations:
 
         for tid in pruned_ids:            
             del tracks[tid]
+        self.metrics.add("tracks_pruned", len(pruned_ids))
         
         return tracks
+
+    def _deduplicate_tracks(self, lib : Library) -> Library:
+        """
+        Collapses tracks whose files have the same content into one canonical track (the one with the
+        most cues and grid markers, or the first one), and redirects playlist entries to it. A playlist
+        keeps the entries of one of the copies it contained (the canonical track if present, or the first
+        copy), so repeats of the same track are kept while the other copies are dropped.
+        Candidates are files with the same size and (Rekordbox) duration; only those are hashed.
+        """
+        tracks = lib.track_dict
+        groups = collections.defaultdict(set)
+        for tid in self._iter_progress("Finding duplicate candidates", tracks):
+            t = tracks[tid]
+            path = Utils.url2path(t.fileurl)
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                continue
+            groups[(size, t.duration)].add(path)
+
+        paths = [p for g in groups.values() if len(g) > 1 for p in sorted(g)]
+        hashes = self.probe.hash_files(paths) if len(paths) > 0 else {}
+
+        by_content = collections.defaultdict(list)
+        for tid, t in tracks.items():
+            path = Utils.url2path(t.fileurl)
+            if path in hashes:
+                by_content[hashes[path]].append(tid)
+
+        canonical = {}
+        """ {duplicate tid: canonical tid} """
+        for tids in by_content.values():
+            if len(tids) < 2:
+                continue
+            keep = max(tids, key=lambda tid: len(tracks[tid].cues) + len(tracks[tid].grids))
+            for tid in tids:
+                if tid != keep:
+                    logging.info(f"Duplicate track: {tracks[tid].name} @ {tracks[tid].fileurl} "
+                                 f"(same as {tracks[keep].fileurl})")
+                    canonical[tid] = keep
+
+        if len(canonical) == 0:
+            return lib
+
+        stack = [lib.playl_tree] if lib.playl_tree is not None else []
+        while stack:
+            p = stack.pop()
+            if p.type == Playlist.Type.Folder:
+                stack.extend(p.children)
+            elif p.type == Playlist.Type.List:
+                source = {k: k for k in p.children if k not in canonical}
+                """ {canonical tid: tid of the copy whose entries the playlist keeps} """
+                children = []
+                for k in p.children:
+                    if source.setdefault(canonical.get(k, k), k) == k:
+                        children.append(canonical.get(k, k))
+                p.children = children
+
+        for tid in canonical:
+            del tracks[tid]
+        logging.info(f"Removed {len(canonical)} duplicate track(s).")
+        self.metrics.add("duplicates_removed", len(canonical))
+
+        return lib
     
     def _prune_redundant_grid_markers(self, tracks : dict) -> Library:
         """
         Remove adjacent grid markers with less than 0.5% BPM change.
         """
-        for tid in tracks:
+        for tid in self._iter_progress("Smoothing grid markers", tracks):
             grids = []
             lastg = GridMarker()
             for g in tracks[tid].grids:
@@ -585,6 +2730,106 @@ class OptionalOperations:
         
         return tracks
 
+    def _compact_grid_markers(self, tracks : dict) -> dict:
+        """
+        Replaces the grid markers of each track by as few constant-tempo segments as possible,
+        while keeping every beat within GridMaxDriftMs of its original position.
+        """
+        tolerance = self.config.getfloat("Options", "GridMaxDriftMs", fallback=2.0) / 1000.0
+        snap = self.config.getfloat("Options", "GridBpmSnapTolerance", fallback=0.5)
+
+        n_before, n_after = 0, 0
+        for tid in self._iter_progress("Compacting grid markers", tracks):
+            t = tracks[tid]
+            end = t.playtime if t.playtime > 0.0 else float(t.duration)
+            n_before += len(t.grids)
+            t.grids = self._compact_grid(t.grids, end, tolerance, snap)
+            n_after += len(t.grids)
+
+        logging.info(f"Compacted {n_before} grid marker(s) into {n_after}.")
+        self.metrics.add("grid_markers_removed", n_before - n_after)
+        return tracks
+
+    @staticmethod
+    def _compact_grid(grids : list, end : float, tolerance : float, snap : float) -> list:
+        """
+        Greedy, single pass segmentation of a (dynamic) beat grid.
+
+        Every marker is an anchor at beat B_k (counted from the first marker) and time t_k; the end of
+        the track is one more anchor, at the (fractional) beat it falls on. A segment starting at anchor
+        a can be extended to anchor k as long as some beat period p keeps the error
+        e_k = t_a + (B_k - B_a)*p - t_k within [0, tolerance] for all anchors in between; the feasible
+        periods form an interval that is narrowed at each anchor. Between anchors both grids are linear,
+        so the error is bounded by its value at the anchors. The error is one-sided so that the last beat
+        of a segment never lands just before the marker starting the next one (a doubled beat).
+        Segments also break wherever the time signature or the bar phase changes.
+
+        @param grids        Grid markers, sorted by start.
+        @param end          Track duration in seconds (ignored if not past the last marker).
+        @param tolerance    Maximum beat position error, in seconds.
+        @param snap         Segments snap to the nearest integer BPM if it's within this many BPM
+                            of the segment's tempo and still feasible.
+        @return Compacted grid markers.
+        """
+        if len(grids) == 0:
+            return grids
+
+        anchors = [(grids[0].start, 0)]
+        for g, h in zip(grids, grids[1:]):
+            anchors.append((h.start, anchors[-1][1] + round((h.start - g.start) * g.bpm / 60.0)))
+        if end > grids[-1].start and grids[-1].bpm > 0.0:
+            anchors.append((end, anchors[-1][1] + (end - grids[-1].start) * grids[-1].bpm / 60.0))
+
+        def make_marker(a, lo, hi):
+            g = grids[a]
+            m = GridMarker()
+            m.start, m.beat, m.timesig, m.bpm = g.start, g.beat, g.timesig, g.bpm
+            if hi < math.inf:
+                bpm_lo, bpm_hi = 60.0 / hi, (60.0 / lo if lo > 0.0 else math.inf)
+                bpm = 120.0 / (lo + hi)
+                if abs(round(bpm) - bpm) <= snap and bpm_lo <= round(bpm) <= bpm_hi:
+                    m.bpm = float(round(bpm))
+                elif not bpm_lo <= g.bpm <= bpm_hi:
+                    m.bpm = bpm
+            return m
+
+        compacted = []
+        a, k = 0, 1
+        lo, hi = 0.0, math.inf
+        while k < len(anchors):
+            (t_a, b_a), (t_k, b_k) = anchors[a], anchors[k]
+            db = b_k - b_a
+            if db > 0 and k < len(grids):
+                num = grids[a].timesig[0]
+                if grids[k].timesig != grids[a].timesig or (grids[a].beat + db) % num != grids[k].beat % num:
+                    # The bar changes at marker k, so the next segment starts there.
+                    compacted.append(make_marker(a, lo, hi))
+                    a, k = k, k + 1
+                    lo, hi = 0.0, math.inf
+                    continue
+            feasible = db > 0
+            if feasible:
+                slack = tolerance if k == len(grids) else 0.0  # nothing follows the end of the track
+                new_lo, new_hi = max(lo, (t_k - t_a - slack) / db), min(hi, (t_k - t_a + tolerance) / db)
+                feasible = new_lo <= new_hi
+
+            if feasible:
+                lo, hi = new_lo, new_hi
+                k += 1
+            elif k - 1 == a:
+                # Not even the next marker fits: keep this one as it is.
+                compacted.append(make_marker(a, 0.0, math.inf))
+                a, k = k, k + 1
+                lo, hi = 0.0, math.inf
+            else:
+                compacted.append(make_marker(a, lo, hi))
+                a = k - 1
+                lo, hi = 0.0, math.inf
+
+        if a < len(grids):
+            compacted.append(make_marker(a, lo, hi))
+        return compacted
+
     def _get_mp3_offset(self, mp3_file_path):
         offset_44k1 = 0.026 # Offsets in ms for each sample rate, as per RB release notes.
         offset_48k0 = 0.024
@@ -619,13 +2864,18 @@ class OptionalOperations:
         """
         Check doc/Traktor Cue Shift.md for more information on this function.
         """       
-        for tid in tracks:
+        m4a_delays = {}
+        if self.config.get("Options", "M4aEncoderDelay", fallback="fixed") == "probe":
+            m4a_paths = [Utils.url2path(t.fileurl) for t in tracks.values() if os.path.splitext(t.fileurl)[1] == ".m4a"]
+            m4a_delays = {p: info.delay for p, info in self.probe.probe_files(m4a_paths).items() if info.delay is not None}
+
+        for tid in self._iter_progress("Fixing cue positions", tracks):
             t = tracks[tid]
             dcue = 0.0
             _, extension = os.path.splitext(t.fileurl)
 
             if extension == ".m4a":
-                dcue = -0.048
+                dcue = -m4a_delays.get(Utils.url2path(t.fileurl), 0.048)
             elif extension == ".mp3":
                 path = Utils.url2path(t.fileurl)
                 dcue = self._get_mp3_offset(path)
@@ -655,7 +2905,7 @@ class OptionalOperations:
             # default to track's overall bpm if a cue was somehow before the first marker:
             return t.bpm
 
-        for tid in tracks:
+        for tid in self._iter_progress("Quantizing loops", tracks):
             t = tracks[tid]    
             for i in range(0, len(t.cues)):
                 c = t.cues[i]
@@ -672,7 +2922,7 @@ class OptionalOperations:
         Attribute pads to (a subset) of cues, so that they're visible on the S5/S8.
         Behavior is hard-coded to the author's (me) convenience :)
         """
-        for tid in tracks:
+        for tid in self._iter_progress("Assigning cues to pads", tracks):
             t = tracks[tid]
             pad = 7
             for i in reversed(range(0, len(t.cues))):
@@ -701,6 +2951,13 @@ if __name__ == "__main__":
     parser.add_argument('TraktorNmlOutput', nargs='?', default=None,
                         help="Output path of generated Traktor NML collection.")
     parser.add_argument('-c', '--conf', action='store', default="rb2tk.ini")
+    parser.add_argument('-p', '--playlist', action='append', default=None, metavar='GLOB',
+                        help="Only export playlists matching this path glob (e.g. 'Gigs/Gig 2026-*'). "
+                             "Can be repeated.")
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help="Print what would change in the collection, without writing it.")
+    parser.add_argument('--plan', action='store', default=None, metavar='FILE',
+                        help="Like --dry-run, but save the change plan as JSON to FILE ('-' for stdout).")
     parser.add_argument('-v', '--verbose', action='count', default=0)
     parser.add_argument('--version', action='version', version='%(prog)s v' + RB2TK_VERSION)
 
@@ -725,12 +2982,39 @@ if __name__ == "__main__":
     elif not config.has_option("Library", "TraktorNmlOutput"):
         config["Library"]["TraktorNmlOutput"] = "collection.nml"
 
+    if args.playlist is not None:
+        config["Library"]["ExportPlaylists"] = "\n".join(args.playlist)
+
     ''' Main '''
-    rr = RekordboxReader(config)
-    tw = TraktorWriter(config)
-    oo = OptionalOperations(config)
+    metrics = Metrics()
+    rr = RekordboxReader(config, metrics=metrics)
+    tw = TraktorWriter(config, metrics=metrics)
+    oo = OptionalOperations(config, metrics=metrics)
+
+    ok = False
+    try:
+        with metrics.run():
+            with metrics.phase("Read"):
+                lib = rr.read(config["Library"]["RekordboxXmlInput"])
+            with metrics.phase("Operations"):
+                lib = oo.apply(lib)
+
+            if args.dry_run or args.plan is not None:
+                with metrics.phase("Plan"):
+                    plan = tw.plan(lib, config["Library"]["TraktorNmlOutput"])
+                if args.plan is None:
+                    print(tw.format_plan(plan))
+                elif args.plan == "-":
+                    print(json.dumps(plan, indent=2))
+                else:
+                    with open(args.plan, "w", encoding="utf-8") as f:
+                        json.dump(plan, f, indent=2)
+                ok = True
+            else:
+                with metrics.phase("Write"):
+                    ok = tw.write(lib, config["Library"]["TraktorNmlOutput"])
+    finally:
+        metrics.save(config, ok)
 
-    lib = rr.read(config["Library"]["RekordboxXmlInput"])
-    lib = oo.apply(lib)
-    exit(0 if tw.write(lib, config["Library"]["TraktorNmlOutput"]) else 1)
+    exit(0 if ok else 1)
 
@@ -0,0 +1,56 @@
+"""
+Tests of DeduplicateTracks, on small synthetic files.
+"""
+import os
+import tempfile
+import unittest
+
+import rb2tk
+from tests.util import make_config, make_node, make_track
+
+
+class DeduplicateTracksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        contents = {"a.mp3": b"a" * 1000, "a2.mp3": b"a" * 1000, "a3.mp3": b"a" * 1000, "b.mp3": b"b" * 1000}
+        for name, data in contents.items():
+            with open(os.path.join(self.tmp.name, name), "wb") as f:
+                f.write(data)
+        self.lib = rb2tk.Library()
+        self.lib.track_dict = {}
+        for tid, name in zip("1234", contents):
+            self.lib.track_dict[tid] = make_track(tid, "file://localhost" + os.path.join(self.tmp.name, name))
+        self.lib.track_dict["1"].cues = [rb2tk.Cue()]  # The canonical copy of 1, 2 and 3
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _deduplicate(self, playlists : dict) -> dict:
+        self.lib.playl_tree = make_node("ROOT", [make_node(name, keys) for name, keys in playlists.items()], True)
+        ops = rb2tk.OptionalOperations(make_config(options={"ProbeCache": "no"}))
+        lib = ops._deduplicate_tracks(self.lib)
+        return {p.name: p.children for p in lib.playl_tree.children}
+
+    def test_removes_copies(self):
+        playlists = self._deduplicate({"P": ["4"]})
+        self.assertEqual(sorted(self.lib.track_dict), ["1", "4"])
+        self.assertEqual(playlists, {"P": ["4"]})
+
+    def test_collapses_copies(self):
+        playlists = self._deduplicate({"Canonical first": ["1", "2", "4"],
+                                       "Copy first": ["2", "4", "1", "3"],
+                                       "Copies only": ["3", "2", "4"]})
+        self.assertEqual(playlists, {"Canonical first": ["1", "4"],
+                                     "Copy first": ["4", "1"],
+                                     "Copies only": ["1", "4"]})
+
+    def test_keeps_repeats(self):
+        playlists = self._deduplicate({"Repeat": ["1", "4", "1"],
+                                       "Repeated copy": ["2", "4", "2", "3"]})
+        self.assertEqual(playlists, {"Repeat": ["1", "4", "1"],
+                                     "Repeated copy": ["1", "4", "1"]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Tests of CompactGridMarkers on synthetic beat grids.
+"""
+import math
+import unittest
+
+import rb2tk
+
+
+def make_grid(bpms : list, beats_per_marker : int = 4, start : float = 0.1) -> list:
+    """ One marker every beats_per_marker beats, each at the given tempo until the next one. """
+    grids = []
+    for bpm in bpms:
+        g = rb2tk.GridMarker()
+        g.start, g.bpm = start, bpm
+        grids.append(g)
+        start += beats_per_marker * 60.0 / bpm
+    return grids
+
+
+class CompactGridTest(unittest.TestCase):
+    TOLERANCE = 0.002
+
+    def _compact(self, grids : list, end : float, snap : float = 0.0) -> list:
+        return rb2tk.OptionalOperations._compact_grid(grids, end, self.TOLERANCE, snap)
+
+    def assertWithinTolerance(self, grids : list, compacted : list):
+        """ Every original marker (a beat) must be at most TOLERANCE before its compacted position. """
+        beats = [0]
+        for g, h in zip(grids, grids[1:]):
+            beats.append(beats[-1] + round((h.start - g.start) * g.bpm / 60.0))
+        beat_of = {g.start: b for g, b in zip(grids, beats)}
+        for g, b in zip(grids, beats):
+            m = [m for m in compacted if m.start <= g.start][-1]
+            error = m.start + (b - beat_of[m.start]) * 60.0 / m.bpm - g.start
+            self.assertGreaterEqual(error, -1e-9)
+            self.assertLessEqual(error, self.TOLERANCE + 1e-9)
+
+    def test_constant_tempo(self):
+        grids = make_grid([120.0] * 100)
+        compacted = self._compact(grids, grids[-1].start + 2.0)
+        self.assertEqual([(m.start, m.bpm) for m in compacted], [(0.1, 120.0)])
+
+    def test_tempo_change(self):
+        grids = make_grid([120.0] * 50 + [126.0] * 50)
+        compacted = self._compact(grids, grids[-1].start + 2.0)
+        self.assertEqual([(m.start, m.bpm) for m in compacted], [(0.1, 120.0), (grids[50].start, 126.0)])
+
+    def test_drift_within_tolerance(self):
+        # A live recording: the tempo wanders around 120 BPM.
+        grids = make_grid([120.0 + 0.4 * math.sin(i / 7.0) + 0.05 * math.sin(i * 1.3) for i in range(300)])
+        for snap in (0.0, 0.5):
+            compacted = self._compact(grids, grids[-1].start + 2.0, snap)
+            self.assertLess(len(compacted), len(grids))
+            self.assertEqual(compacted[0].start, grids[0].start)
+            self.assertWithinTolerance(grids, compacted)
+
+    def test_time_signature_change(self):
+        grids = make_grid([120.0] * 10)
+        waltz = make_grid([120.0] * 10, beats_per_marker=3, start=grids[-1].start + 2.0)
+        for g in waltz:
+            g.timesig = [3, 4]
+        grids += waltz
+        compacted = self._compact(grids, grids[-1].start + 2.0)
+        self.assertEqual([m.timesig for m in compacted], [[4, 4], [3, 4]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import rb2tk
+from tests.util import make_config, make_node, make_track, read_elements
+
+
+def make_library(tids : list) -> rb2tk.Library:
+    lib = rb2tk.Library()
+    lib.track_dict = {tid: make_track(tid) for tid in tids}
+    for t in lib.track_dict.values():
+        cue = rb2tk.Cue()
+        cue.start, cue.num = 1.5, 0
+        t.cues = [cue]
+    lib.playl_tree = make_node("ROOT", [make_node("All", list(tids))], True)
+    return lib
+
+
+class StreamingMergeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base = os.path.join(self.tmp.name, "base.nml")
+        self.assertTrue(rb2tk.TraktorWriter(make_config()).write(make_library(["1", "2", "3"]), self.base))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def merge(self, name : str, library : dict) -> str:
+        path = os.path.join(self.tmp.name, name)
+        if not os.path.exists(path):
+            shutil.copy(self.base, path)
+        self.assertTrue(rb2tk.TraktorWriter(make_config(library)).write(make_library(["2", "3", "4"]), path))
+        return path
+
+    def test_same_as_regular_merge(self):
+        expected = read_elements(self.merge("dom.nml", {}))
+        self.assertEqual(read_elements(self.merge("stream.nml", {"StreamingMerge": "yes"})), expected)
+        self.assertEqual(read_elements(self.merge("index.nml", {"StreamingMerge": "yes", "CollectionIndex": "yes"})),
+                         expected)
+
+    def test_stale_index(self):
+        path = os.path.join(self.tmp.name, "stale.nml")
+        shutil.copy(self.base, path)
+        rb2tk.CollectionIndex.load_or_build(path)
+
+        # Swap two entries' files without changing the collection's size or mtime: the index
+        # still looks current, but no longer matches the collection.
+        st = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        data = data.replace(b'FILE="1.mp3"', b'FILE="x.mp3"').replace(b'FILE="2.mp3"', b'FILE="1.mp3"') \
+                   .replace(b'FILE="x.mp3"', b'FILE="2.mp3"')
+        with open(path, 'wb') as f:
+            f.write(data)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        shutil.copy(path, os.path.join(self.tmp.name, "dom.nml"))
+
+        with self.assertLogs(level="WARNING") as logs:
+            self.merge("stale.nml", {"StreamingMerge": "yes", "CollectionIndex": "yes"})
+        self.assertIn("out of sync", "\n".join(logs.output))
+        self.assertEqual(read_elements(path), read_elements(self.merge("dom.nml", {})))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+"""
+Tests of the metrics reported at the end of a run.
+"""
+import re
+import unittest
+
+import rb2tk
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_counters_preregistered(self):
+        metrics = rb2tk.Metrics()
+        metrics.add("tracks_read", 3)
+        counters = metrics.to_dict(True)["counters"]
+        self.assertEqual(set(counters), set(rb2tk.Metrics.COUNTERS))
+        self.assertEqual((counters["tracks_read"], counters["tracks_moved"]), (3, 0))
+        self.assertIn("rb2tk_tracks_locked_skipped 0\n", metrics.to_prometheus(True))
+
+    def test_phases_and_stages_separate(self):
+        metrics = rb2tk.Metrics()
+        with metrics.run():
+            with metrics.phase("Read"):
+                metrics.add_time("Reading tracks", 1.0)
+            with metrics.phase("Write"):
+                pass
+        text = metrics.to_prometheus(True)
+        families = {m.group(1): m.group(2) for m in re.finditer(r'^(rb2tk_\w+)\{(\w+)=', text, re.M)}
+        self.assertEqual(families, {"rb2tk_phase_duration_seconds": "phase",
+                                    "rb2tk_stage_duration_seconds": "stage"})
+        self.assertEqual(re.findall(r'phase="(\w+)"', text), ["Read", "Write"])
+        self.assertIn('rb2tk_stage_duration_seconds{stage="Reading tracks"} 1.000000', text)
+        self.assertRegex(text, r"\nrb2tk_last_run_duration_seconds \d")
+        self.assertGreaterEqual(metrics.duration, sum(metrics.phases.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import rb2tk
+from tests.util import make_config
+
+
+def make_writer():
+    return rb2tk.TraktorWriter(make_config())
+
+
+class IsFileMissingTest(unittest.TestCase):
+    def is_missing(self, writer, path : str) -> bool:
+        loc = writer._generate_location("file://localhost" + path)
+        return writer._is_file_missing(loc["VOLUME"], loc["DIR"], loc["FILE"])
+
+    def test_existing_and_missing_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "a.mp3")
+            open(path, "wb").close()
+            writer = make_writer()
+            self.assertFalse(self.is_missing(writer, path))
+            self.assertTrue(self.is_missing(writer, os.path.join(d, "gone.mp3")))
+
+    def test_unknown_top_level_directory(self):
+        self.assertFalse(self.is_missing(make_writer(), "/rb2tk-no-such-volume/Music/a.mp3"))
+
+    @unittest.skipIf(os.path.ismount("/Volumes/rb2tk-unplugged"), "volume exists")
+    def test_unmounted_volume(self):
+        for path in ["/Volumes/rb2tk-unplugged/Music/a.mp3",
+                     "/media/user/rb2tk-unplugged/Music/a.mp3",
+                     "/run/media/user/rb2tk-unplugged/a.mp3",
+                     "/mnt/rb2tk-unplugged/a.mp3"]:
+            self.assertFalse(self.is_missing(make_writer(), path), path)
+
+    def test_unmounted_volume_darwin(self):
+        # rb2tk's own locations on macOS: the startup disk as VOLUME, the full path as DIR.
+        writer = make_writer()
+        with mock.patch("sys.platform", "darwin"), \
+             mock.patch.object(writer, "_get_path_volume", return_value="Macintosh HD"):
+            self.assertFalse(self.is_missing(writer, "/Volumes/rb2tk-unplugged/Music/a.mp3"))
+            # As written by Traktor: the drive's name as VOLUME, DIR relative to it.
+            self.assertFalse(writer._is_file_missing("rb2tk-unplugged", "/:Music/:", "a.mp3"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+
+import rb2tk
+from tests.util import make_config, make_node, make_track
+
+
+def make_library(foo : list) -> rb2tk.Library:
+    """ ROOT / F / {A / bar, A / foo}: two sibling folders with the same name. """
+    lib = rb2tk.Library()
+    lib.track_dict = {tid: make_track(tid) for tid in ["1", "2", "3", "4"]}
+    lib.playl_tree = make_node("ROOT", [
+        make_node("F", [make_node("A", [make_node("bar", ["1"])], True),
+                        make_node("A", [make_node("foo", foo)], True)], True)], True)
+    return lib
+
+
+def select(lib : rb2tk.Library, *patterns) -> rb2tk.Library:
+    lib.playl_selection = {}
+    reader = rb2tk.RekordboxReader(make_config())
+    lib.playl_tree = reader._select_nodes(lib.playl_tree, list(patterns), lib.playl_selection)
+    return lib
+
+
+def read_tree(path : str) -> list:
+    """ @return [(depth, name, [track keys] or None for folders)] below the 'rekordbox' folder. """
+    xml = rb2tk.XmlBackend()
+    root = xml.parse(path)
+    export_e = next(n for n in root.iter("NODE") if n.attrib.get("NAME") == "rekordbox")
+    nodes = []
+    stack = [(n, 0) for n in reversed(export_e.findall("SUBNODES/NODE"))]
+    while stack:
+        n, depth = stack.pop()
+        keys = [e.attrib["KEY"] for e in n.iter("PRIMARYKEY")] if n.attrib["TYPE"] == "PLAYLIST" else None
+        nodes.append((depth, n.attrib["NAME"], keys))
+        stack.extend((c, depth + 1) for c in reversed(n.findall("SUBNODES/NODE")))
+    return nodes
+
+
+class PartialExportTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "collection.nml")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_selection_keys(self):
+        lib = select(make_library(["2"]), "F/A/foo")
+        self.assertEqual(list(lib.playl_selection), [("F", "A" + rb2tk.Playlist.DUP_SEP + "1", "foo")])
+
+    def test_replaces_playlist_below_same_named_folder(self):
+        config = make_config()
+        self.assertTrue(rb2tk.TraktorWriter(config).write(make_library(["2", "3"]), self.path))
+        self.assertTrue(rb2tk.TraktorWriter(config).write(select(make_library(["4"]), "F/A/foo"), self.path))
+        self.assertEqual(read_tree(self.path), [
+            (0, "F", None),
+            (1, "A", None), (2, "bar", ["music/:1.mp3"]),
+            (1, "A", None), (2, "foo", ["music/:4.mp3"])])
+
+    def test_same_named_playlists(self):
+        def library(second):
+            lib = rb2tk.Library()
+            lib.track_dict = {tid: make_track(tid) for tid in ["1", "2", "3"]}
+            lib.playl_tree = make_node("ROOT", [make_node("Dup", ["1"]), make_node("Dup", second)], True)
+            return lib
+
+        config = make_config()
+        self.assertTrue(rb2tk.TraktorWriter(config).write(library(["2"]), self.path))
+        self.assertTrue(rb2tk.TraktorWriter(config).write(select(library(["3"]), "Dup"), self.path))
+        self.assertEqual(read_tree(self.path), [(0, "Dup", ["music/:1.mp3"]), (0, "Dup", ["music/:3.mp3"])])
+
+
+class PlaylistPlanTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "collection.nml")
+        self.assertTrue(rb2tk.TraktorWriter(make_config()).write(make_library(["2", "3"]), self.path))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def plan(self, lib : rb2tk.Library) -> dict:
+        return rb2tk.TraktorWriter(make_config()).plan(lib, self.path)["playlists"]
+
+    def test_unchanged(self):
+        nothing = {"added": [], "removed": [], "changed": []}
+        self.assertEqual(self.plan(make_library(["2", "3"])), nothing)
+        self.assertEqual(self.plan(select(make_library(["2", "3"]), "F/A/foo")), nothing)
+
+    def test_changed_same_named_sibling(self):
+        for lib in [make_library(["4"]), select(make_library(["4"]), "F/A/foo")]:
+            changes = self.plan(lib)
+            self.assertEqual(changes["added"], [])
+            self.assertEqual(changes["removed"], [])
+            self.assertEqual(changes["changed"], [{"path": "F/A (2)/foo", "tracks_added": 1, "tracks_removed": 2,
+                                                   "reordered": False}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+Tests of the header parsers of AudioProbe, on small synthetic audio files.
+"""
+import math
+import os
+import struct
+import tempfile
+import unittest
+import wave
+
+import rb2tk
+from tests.util import make_config
+
+
+def box(kind : bytes, payload : bytes) -> bytes:
+    return struct.pack(">I", 8 + len(payload)) + kind + payload
+
+
+def mp4_file(trak_extra : bytes = b"", moov_extra : bytes = b"") -> bytes:
+    """ M4A of 5s at 44.1kHz, 256kbit/s; trak_extra goes before the mdia box of the track. """
+    mdhd = box(b"mdhd", b"\0" * 12 + struct.pack(">II", 44100, 44100 * 5) + b"\0" * 4)
+    hdlr = box(b"hdlr", b"\0" * 8 + b"soun" + b"\0" * 12)
+    dcd = bytes([0x04, 0x80, 0x80, 0x80, 13, 0x40, 0x15]) + b"\0\0\0" + struct.pack(">II", 260000, 256000)
+    esds = box(b"esds", b"\0" * 4 + bytes([0x03, 3 + len(dcd)]) + b"\0\1\0" + dcd)
+    mp4a = box(b"mp4a", b"\0" * 6 + b"\0\1" + b"\0" * 8 + struct.pack(">HHHHI", 2, 16, 0, 0, 44100 << 16) + esds)
+    stsd = box(b"stsd", b"\0" * 4 + struct.pack(">I", 1) + mp4a)
+    mdia = box(b"mdia", mdhd + hdlr + box(b"minf", box(b"stbl", stsd)))
+    moov = box(b"moov", box(b"trak", trak_extra + mdia) + moov_extra)
+    return box(b"ftyp", b"M4A \0\0\0\0") + moov + box(b"mdat", b"\0" * 1000)
+
+
+class ProbeFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.probe = rb2tk.AudioProbe(make_config(options={"ProbeCache": "no"}))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _probe(self, name : str, data : bytes = None):
+        path = os.path.join(self.tmp.name, name)
+        if data is not None:
+            with open(path, "wb") as f:
+                f.write(data)
+        return self.probe.probe_file(path)
+
+    def test_mp3_cbr(self):
+        frame = struct.pack(">I", 0xFFFB9000) + b"\0" * 413  # MPEG-1 layer 3, 128kbit/s, 44.1kHz
+        info = self._probe("cbr.mp3", b"ID3\x04\0\0\0\0\0\x05" + b"\0" * 5 + frame * 1000)
+        self.assertEqual((info.bitrate, info.samplerate), (128000, 44100))
+        self.assertAlmostEqual(info.duration, 1000 * 1152 / 44100, delta=0.1)
+
+    def test_mp3_xing(self):
+        header = struct.pack(">I", 0xFFFB9400)  # MPEG-1 layer 3, 128kbit/s, 48kHz
+        xing = header + b"\0" * 32 + b"Xing" + struct.pack(">III", 3, 2000, 2000 * 384)
+        info = self._probe("vbr.mp3", xing.ljust(384, b"\0") + (header + b"\0" * 380) * 2000)
+        self.assertEqual((info.bitrate, info.samplerate), (128000, 48000))
+        self.assertAlmostEqual(info.duration, 2000 * 1152 / 48000)
+
+    def test_mp4(self):
+        info = self._probe("a.m4a", mp4_file())
+        self.assertEqual(info, rb2tk.AudioProbe.Info(256000, 44100, 5.0, None))
+
+    def test_mp4_itunsmpb(self):
+        smpb = b" 00000000 00000840 000001CC 0000000000A2D834 00000000"
+        item = box(b"----", box(b"mean", b"\0" * 4 + b"com.apple.iTunes") + box(b"name", b"\0" * 4 + b"iTunSMPB")
+                   + box(b"data", struct.pack(">II", 1, 0) + smpb))
+        meta = box(b"meta", b"\0" * 4 + box(b"hdlr", b"\0" * 8 + b"mdir" + b"\0" * 12) + box(b"ilst", item))
+        info = self._probe("smpb.m4a", mp4_file(moov_extra=box(b"udta", meta)))
+        self.assertAlmostEqual(info.delay, 0x840 / 44100)
+
+    def test_mp4_edit_list(self):
+        elst = box(b"elst", b"\0" * 4 + struct.pack(">I", 2) + struct.pack(">IiI", 0, -1, 1 << 16)
+                   + struct.pack(">IiI", 44100 * 5, 1024, 1 << 16))
+        info = self._probe("elst.m4a", mp4_file(trak_extra=box(b"edts", elst)))
+        self.assertAlmostEqual(info.delay, 1024 / 44100)
+
+    def test_flac(self):
+        bits = (44100 << 44) | (1 << 41) | (15 << 36) | 441000  # 2 channels, 16 bits, 10s
+        streaminfo = struct.pack(">HH", 4096, 4096) + b"\0" * 6 + bits.to_bytes(8, "big") + b"\0" * 16
+        info = self._probe("a.flac", b"fLaC" + bytes([0x80]) + len(streaminfo).to_bytes(3, "big")
+                           + streaminfo + b"\0" * 1000)
+        self.assertEqual((info.samplerate, info.duration), (44100, 10.0))
+
+    def test_wav(self):
+        w = wave.open(os.path.join(self.tmp.name, "a.wav"), "wb")
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(44100)
+        w.writeframes(b"\0" * 44100 * 4)
+        w.close()
+        self.assertEqual(self._probe("a.wav"), rb2tk.AudioProbe.Info(1411200, 44100, 1.0, None))
+
+    def test_aiff(self):
+        frames = 48000 * 2
+        exponent = int(math.log2(48000))
+        rate = struct.pack(">HQ", exponent + 16383, int(48000 * 2 ** (63 - exponent)))
+        comm = struct.pack(">HIH", 2, frames, 24) + rate
+        ssnd = b"\0" * (8 + frames * 6)
+        body = (b"AIFF" + b"COMM" + struct.pack(">I", len(comm)) + comm
+                + b"SSND" + struct.pack(">I", len(ssnd)) + ssnd)  # Chunk sizes exclude the header
+        info = self._probe("a.aiff", b"FORM" + struct.pack(">I", len(body)) + body)
+        self.assertEqual(info, rb2tk.AudioProbe.Info(2304000, 48000, 2.0, None))
+
+    def test_unknown(self):
+        self.assertIsNone(self._probe("a.mp3", b"\0" * 1000))
+        self.assertIsNone(self._probe("missing.mp3"))
+
+
+class ProbeCacheTest(unittest.TestCase):
+
+    def test_default_next_to_output(self):
+        config = make_config(library={"TraktorNmlOutput": "/out/collection.nml"})
+        self.assertEqual(rb2tk.AudioProbe(config).cache.path, "/out/collection.nml.rb2tk-probe.json")
+
+    def test_disabled(self):
+        for value in ("no", ""):
+            config = make_config(library={"TraktorNmlOutput": "/out/collection.nml"}, options={"ProbeCache": value})
+            self.assertEqual(rb2tk.AudioProbe(config).cache.path, "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Tests of RekordboxReader on a small synthetic Rekordbox XML.
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import rb2tk
+from tests.util import make_config
+
+
+def write_rekordbox_xml(path : str, n_tracks : int):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<DJ_PLAYLISTS Version="1.0.0">',
+             f'  <COLLECTION Entries="{n_tracks}">']
+    for i in range(1, n_tracks + 1):
+        lines += [f'    <TRACK TrackID="{i}" Name="Track {i}" Artist="Artist" Composer="" Album="Album" Grouping=""'
+                  ' Genre="House" Kind="MP3 File" Size="1" TotalTime="200" DiscNumber="0" TrackNumber="0" Year="0"'
+                  ' AverageBpm="120.00" DateAdded="2026-10-01" BitRate="320" SampleRate="44100" Comments=""'
+                  ' PlayCount="0" Rating="0" Remixer="" Tonality="Am" Label="" Mix=""'
+                  f' Location="file://localhost/music/{i}.mp3">',
+                  f'      <TEMPO Inizio="0.{i:03d}" Bpm="120.00" Metro="4/4" Battito="1"/>',
+                  f'      <POSITION_MARK Name="" Type="0" Start="{i}.000" Num="0"/>',
+                  '    </TRACK>']
+    lines += ['  </COLLECTION>',
+              '  <PLAYLISTS>',
+              '    <NODE Type="0" Name="ROOT" Count="1">',
+              f'      <NODE Name="All" Type="1" KeyType="0" Entries="{n_tracks}">']
+    lines += [f'        <TRACK Key="{i}"/>' for i in range(1, n_tracks + 1)]
+    lines += ['      </NODE>', '    </NODE>', '  </PLAYLISTS>', '</DJ_PLAYLISTS>']
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+def as_plain(obj):
+    """ Track, cue and grid objects as nested dicts, to be compared. """
+    if isinstance(obj, (list, tuple)):
+        return [as_plain(o) for o in obj]
+    if isinstance(obj, dict):
+        return {k: as_plain(v) for k, v in obj.items()}
+    if hasattr(obj, "__slots__"):
+        return {k: as_plain(getattr(obj, k)) for k in obj.__slots__}
+    if hasattr(obj, "__dict__"):
+        return as_plain(vars(obj))
+    return obj
+
+
+class ParallelParseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "rekordbox.xml")
+        write_rekordbox_xml(self.path, 40)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _read(self, workers : int):
+        return rb2tk.RekordboxReader(make_config(options={"ParseWorkers": str(workers)})).read(self.path)
+
+    def test_section_offsets(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        sections = rb2tk.RekordboxReader(make_config())._scan_sections(self.path)
+        self.assertEqual(len(sections["tracks"]), 40)
+        self.assertTrue(all(data.startswith(b'<TRACK TrackID="', o) for o in sections["tracks"]))
+        self.assertTrue(data.startswith(b"</COLLECTION>", sections["tracks_end"]))
+
+    def test_same_as_serial(self):
+        serial = self._read(1)
+        with mock.patch("rb2tk.PARALLEL_MIN_TRACKS", 1), self.assertLogs(level="DEBUG") as logs:
+            parallel = self._read(2)
+        self.assertTrue(any("Parsing 40 tracks in 8 shards on 2 processes" in line for line in logs.output))
+        self.assertEqual(len(parallel.track_dict), 40)
+        self.assertEqual(list(parallel.track_dict), list(serial.track_dict))
+        self.assertEqual(as_plain(parallel.track_dict), as_plain(serial.track_dict))
+
+
+if __name__ == "__main__":
+    unittest.main()
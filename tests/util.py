@@ -0,0 +1,37 @@
+"""
+Helpers building small synthetic libraries and collections for the tests.
+"""
+import configparser
+import xml.etree.ElementTree as ET
+
+import rb2tk
+
+
+def make_config(library : dict = None, options : dict = None):
+    config = configparser.ConfigParser()
+    config["Library"] = {"MergeOutput": "yes", **(library or {})}
+    config["Options"] = {"BackupExistingCollection": "no", **(options or {})}
+    return config
+
+
+def make_track(tid : str, fileurl : str = None) -> rb2tk.Track:
+    t = rb2tk.Track()
+    t.id = tid
+    t.name = "Track " + tid
+    t.fileurl = fileurl or f"file://localhost/music/{tid}.mp3"
+    t.rating = "0"  # As read from Rekordbox
+    return t
+
+
+def make_node(name : str, children : list, is_folder=False) -> rb2tk.Playlist:
+    p = rb2tk.Playlist()
+    p.name = name
+    p.type = rb2tk.Playlist.Type.Folder if is_folder else rb2tk.Playlist.Type.List
+    p.children = children
+    return p
+
+
+def read_elements(path : str) -> list:
+    """ @return (tag, attributes) of every element of an XML file, in document order, without UUIDs. """
+    return [(e.tag, sorted((k, v) for k, v in e.attrib.items() if k != "UUID"))
+            for e in ET.parse(path).getroot().iter()]